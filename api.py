@@ -0,0 +1,212 @@
+"""واجهة JSON خفيفة لمؤشرات الخضرة تُخدَم من نفس الكاش الذي تستخدمه اللوحة.
+
+تعمل بجانب اللوحة دون رسم أي خرائط:
+
+    python api.py --port 8502
+
+    GET /v1/metrics?place=الرياض&place=الرياض/الخرج&source=s2&start=2023-01-01&end=2023-12-31
+    GET /v1/timeseries?place=...&source=modis&start=...&end=...
+    GET /v1/change?place=...&source=modis&start=...&end=...&threshold=0.2
+
+`place` يمكن تكراره (منطقة، أو منطقة/مدينة) فتُعاد كل النتائج في رد واحد.
+تُرسل الردود مع ETag و Last-Modified وتدعم If-None-Match / If-Modified-Since.
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+import functools
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import ee
+import ndvi_core
+from ndvi_core import SOURCE_ALIASES, ALL_KSA
+
+RESPONSE_TTL = 600  # ثوانٍ؛ بعدها نعود للكاش المشترك (الذي قد يكون حُدِّث)
+MAX_PLACES = 50
+MAX_RESPONSES = 1024
+
+_pool = ThreadPoolExecutor(max_workers=8)
+_responses = {}  # مفتاح الطلب ← (وقت الحساب، الجسم، ETag، Last-Modified)
+_responses_lock = threading.Lock()
+
+
+def _metrics(cid, region, city, start, end, threshold):
+    _, geom = ndvi_core.focus_area(region, city, cid)
+    place = ndvi_core.place_key(region, city)
+    return ndvi_core.area_metrics(cid, place, start, end, threshold, geom)
+
+
+def _change(cid, region, city, start, end, threshold):
+    _, geom = ndvi_core.focus_area(region, city, cid)
+    place = ndvi_core.place_key(region, city)
+    stats = ndvi_core.compute_change_stats(cid, place, start, end, threshold, geom)
+    return {f"{k}_km2": v for k, v in stats.items()}
+
+
+def _timeseries(cid, region, city, start, end, threshold):
+    _, geom = ndvi_core.focus_area(region, city, cid)
+    place = ndvi_core.place_key(region, city)
+    _, scale = ndvi_core.period_composite(cid, place, start, end, geom)
+    df = ndvi_core.get_time_series(cid, geom, scale, start, end, region, city)
+    return {"series": df[["date", "mean_ndvi"]].to_dict("records")}
+
+
+ENDPOINTS = {"metrics": _metrics, "change": _change, "timeseries": _timeseries}
+
+
+class UnknownPlace(LookupError):
+    """منطقة أو مدينة غير موجودة في أصول Earth Engine (يُعاد 404)."""
+
+
+@functools.lru_cache(maxsize=None)
+def _known_regions():
+    return frozenset(ndvi_core.list_regions())
+
+
+@functools.lru_cache(maxsize=None)
+def _known_cities(region):
+    return frozenset(ndvi_core.list_cities(region))
+
+
+def check_place(region, city):
+    # اسم خاطئ يعطي حدوداً فارغة ثم قسمة على صفر بدل رسالة واضحة
+    if region not in _known_regions():
+        raise UnknownPlace(f"unknown region: {region}")
+    if city and city not in _known_cities(region):
+        raise UnknownPlace(f"unknown city in {region}: {city}")
+
+
+def parse_query(query):
+    """التحقق من معاملات الطلب؛ ValueError أو UnknownPlace برسالة واضحة عند الخطأ."""
+    q = parse_qs(query)
+    source = q.get("source", ["modis"])[0]
+    cid = SOURCE_ALIASES.get(source, source)
+    if cid not in SOURCE_ALIASES.values():
+        raise ValueError(f"unknown source: {source}")
+    try:
+        start = date.fromisoformat(q["start"][0])
+        end = date.fromisoformat(q["end"][0])
+    except KeyError as e:
+        raise ValueError(f"missing parameter: {e.args[0]}")
+    if start >= end:
+        raise ValueError("start must be before end")
+    threshold = float(q.get("threshold", ["0.1"])[0])
+
+    places = q.get("place") or [ALL_KSA]
+    if len(places) > MAX_PLACES:
+        raise ValueError(f"at most {MAX_PLACES} places per request")
+    places = [tuple(p.split("/", 1)) if "/" in p else (p, "") for p in places]
+    for region, city in places:
+        check_place(region, city)
+    return cid, places, start, end, threshold
+
+
+def build_response(kind, query):
+    """الجسم + ETag + Last-Modified، مع كاش قصير في الذاكرة لردود بالملّي ثانية."""
+    cid, places, start, end, threshold = parse_query(query)
+    key = (kind, cid, tuple(places), start, end, threshold)
+    now = time.time()
+    with _responses_lock:
+        cached = _responses.get(key)
+    if cached and now - cached[0] < RESPONSE_TTL:
+        return cached[1:]
+
+    fn = ENDPOINTS[kind]
+    values = _pool.map(lambda p: fn(cid, p[0], p[1], start, end, threshold), places)
+    results = [
+        {"region": region, "city": city, "source": cid, "start": str(start),
+         "end": str(end), "threshold": threshold, **value}
+        for (region, city), value in zip(places, values)
+    ]
+    body = json.dumps({"results": results}, ensure_ascii=False, default=str).encode("utf-8")
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+    # Last-Modified يتغير فقط عندما يتغير المحتوى فعلاً
+    last_modified = cached[3] if cached and cached[2] == etag else \
+        datetime.now(timezone.utc).replace(microsecond=0)
+    with _responses_lock:
+        if len(_responses) >= MAX_RESPONSES:
+            _responses.pop(next(iter(_responses)))  # إزالة الأقدم
+        _responses[key] = (now, body, etag, last_modified)
+    return body, etag, last_modified
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server_version = "SaudiGreenAPI/1.0"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        kind = url.path.strip("/").removeprefix("v1/")
+        if kind not in ENDPOINTS:
+            return self._send_json(404, {"error": f"unknown endpoint: {url.path}"})
+        try:
+            body, etag, last_modified = build_response(kind, url.query)
+        except UnknownPlace as e:
+            return self._send_json(404, {"error": str(e)})
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+        except ee.EEException as e:
+            return self._send_json(502, {"error": f"Earth Engine error: {e}"})
+        except Exception:
+            self.log_error("unhandled error for %s", self.path)
+            return self._send_json(500, {"error": "internal server error"})
+
+        if self._not_modified(etag, last_modified):
+            self.send_response(304)
+            self._send_validators(etag, last_modified)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self._send_validators(etag, last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self, etag, last_modified):
+        inm = self.headers.get("If-None-Match")
+        if inm is not None:
+            return etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+        ims = self.headers.get("If-Modified-Since")
+        if ims:
+            try:
+                return last_modified <= parsedate_to_datetime(ims)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_validators(self, etag, last_modified):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", format_datetime(last_modified, usegmt=True))
+        self.send_header("Cache-Control", f"max-age={RESPONSE_TTL}")
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="واجهة JSON لمؤشرات الخضرة")
+    parser.add_argument("--key", help="ملف JSON لحساب الخدمة (افتراضياً .streamlit/secrets.toml)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args(argv)
+
+    ndvi_core.init_ee(ndvi_core.load_credentials(args.key))
+    server = ThreadingHTTPServer((args.host, args.port), MetricsHandler)
+    print(f"🌿 http://{args.host}:{args.port}/v1/metrics")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,41 +4,38 @@ import geemap.foliumap as geemap
 import folium
 import base64
 import warnings
-import tempfile
+import copy
+import sys
+import uuid
 import math
 import time 
 import streamlit.components.v1 as components
 import pandas as pd
 import branca.colormap as cm
+from collections import OrderedDict
 from folium.plugins import MiniMap
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
 import plotly.express as px
 import os
-from google.oauth2 import service_account
-
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["service-account"],
-    scopes=["https://www.googleapis.com/auth/earthengine.readonly"]
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+import ndvi_core
+from ndvi_core import (
+    SOURCE_IDS, ALL_KSA, place_key, focus_area, list_regions, list_cities,
+    date_range, change_windows, snapped_period, period_composite, area_metrics,
+    get_time_series, compute_change_stats, downsample_series,
 )
 
 # تهيئة Earth Engine باستخدام بيانات الاعتماد
-ee.Initialize(credentials=credentials, project="streamlit-ndvi-project-459419")
-
-# ───────── الأصول الثابتة ─────────
-KSA_ASSET = ee.FeatureCollection("projects/streamlit-ndvi-project-459419/assets/SAUDI")
-AREAS_ASSET = ee.FeatureCollection("projects/streamlit-ndvi-project-459419/assets/REGIONS")
-CITIES_ASSET = ee.FeatureCollection("projects/streamlit-ndvi-project-459419/assets/CITIES")
-SOURCE_IDS = {
-    "MODIS (500 m / 16 day)": "MODIS/061/MOD13A2",
-    "Sentinel-2 (10 m / 5 day)": "COPERNICUS/S2_SR_HARMONIZED",
-    "Landsat 8-9 (30 m / 16 day)": "LANDSAT/LC08/C02/T1_L2",
-}
-ALL_KSA = "المملكة العربية السعودية"
-MIN_YEAR = 2020
-ksa_geom = ee.FeatureCollection(KSA_ASSET).geometry()
+ndvi_core.init_ee(st.secrets["service-account"])
+
+# ───────── تحميل أشكال المملكة والمناطق والـمدن ─────────
+ksa, areas, cities = (ndvi_core.assets()[k] for k in ("ksa", "areas", "cities"))
 
-# ───────── وظائف مساعدة ─────────
+# ───────── موارد مشتركة للقراءة فقط (مرة واحدة لكل عملية) ─────────
+@st.cache_resource(show_spinner=False)
 def b64(fp):
+    """ملف أصول بترميز base64، مشترك بين كل الجلسات."""
     with open(fp, "rb") as f:
         return base64.b64encode(f.read()).decode()
 
@@ -46,104 +43,125 @@ def b64(fp):
 new_logo_path = "assets/KSA.png"
 new_logo_base64 = b64(new_logo_path)  # تحويل اللوجو إلى base64
 
-@st.cache_data(show_spinner=False)
-def date_range(cid):
-    """أقدم/أحدث تاريخ في المصدر، مع احترام حدّ 2020."""
-    ic = ee.ImageCollection(cid)
-    mn = ic.aggregate_min("system:time_start").getInfo()
-    mx = ic.aggregate_max("system:time_start").getInfo()
-    earliest = max(date(MIN_YEAR,1,1), datetime.utcfromtimestamp(mn/1000).date())
-    latest = datetime.utcfromtimestamp(mx/1000).date()
-    return earliest, latest
-
-def ndvi_image(cid, start, end, _geom=None):
-    _geom = _geom or ksa_geom  # استخدم المنطقة المختارة، أو المملكة ككل
-    coll = (ee.ImageCollection(cid)
-            .filterBounds(_geom)
-            .filterDate(str(start), str(end)))
-
-    # فحص للأخطاء الخاصة بـ Sentinel-2
-    if "COPERNICUS" in cid:  # Sentinel-2
-        coll = coll.map(lambda i: i.updateMask(i.select("QA60").Not()))  # إزالة السحب
-        ndvi_coll = coll.map(lambda i: i.normalizedDifference(['B8', 'B4']).rename('NDVI'))
-        img = ndvi_coll.mean()
-        scale = 10
-        print("تم تحميل بيانات Sentinel-2 بنجاح")
-
-    # فحص للأخطاء الخاصة بـ Landsat
-    elif "LANDSAT" in cid:  # Landsat 8-9
-        coll = coll.map(lambda i: i.updateMask(i.select("pixel_qa").eq(0)))  # إزالة السحب
-        ndvi_coll = coll.map(lambda i: i.normalizedDifference(['SR_B5', 'SR_B4']).rename('NDVI'))
-        img = ndvi_coll.mean()
-        scale = 30
-        print("تم تحميل بيانات Landsat بنجاح")
-
-    # فحص لمصادر بيانات أخرى مثل MODIS
-    elif "MODIS" in cid:
-        img = coll.select('NDVI').map(lambda i: i.multiply(1/10000)).mean()
-        scale = 500
-
-    return img.clip(_geom), scale
-
-# --------------------------------
-
-def compute_high_ndvi_ratio(_img, _geom, scale:int, threshold:float=0):
-    mask = _img.gt(threshold)
-    area_img = mask.multiply(ee.Image.pixelArea()).rename("area").clip(_geom)
-    stats = area_img.reduceRegion(
-        ee.Reducer.sum(), geometry=_geom, scale=scale,
-        maxPixels=1e13, bestEffort=True, tileScale=4
-    ).getInfo()
-    high_m2 = stats.get("area", 0)
-    total_m2 = _geom.area().getInfo()
-    return high_m2/total_m2*100
-
-def compute_veg_area_km2(_img, _geom, scale:int, threshold:float=0):
-    mask = _img.gt(threshold)
-    area_img = mask.multiply(ee.Image.pixelArea()).rename("area").clip(_geom)
-    stats = area_img.reduceRegion(
-        ee.Reducer.sum(), geometry=_geom, scale=scale,
-        maxPixels=1e13, bestEffort=True, tileScale=4
-    ).getInfo()
-    return stats.get("area", 0) / 1e6  # المساحة بالكيلومتر المربع
-
-@st.cache_data
-def get_time_series(cid: str, _geom, scale: int, start: date, end: date, region=None, city=None):
-    coll = (ee.ImageCollection(cid)
-            .filterBounds(_geom)
-            .filterDate(str(start), str(end))
-            .select("NDVI"))
-    
-    def feat(img):
-        d = ee.Date(img.get("system:time_start")).format("YYYY-MM-dd")
-        m = img.reduceRegion(ee.Reducer.mean(), _geom, scale).get("NDVI")
-        return ee.Feature(None, {"date": d, "mean": m})
-
-    feats = coll.map(feat).getInfo()["features"]
-    
-    # تحويل النتيجة إلى DataFrame
-    df = pd.DataFrame({
-        "date": [f["properties"]["date"] for f in feats],
-        "mean_ndvi": [f["properties"]["mean"] for f in feats]
-    })
-    
-    # إضافة الأعمدة الخاصة بالمدينة والمنطقة إذا تم تحديدهما
-    if region:
-        df["region"] = region
-    if city:
-        df["city"] = city
-
-    return df
-# --------------------------------
-def _b64(fp):
-    with open(fp, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+_b64 = b64
+
+@st.cache_resource(show_spinner=False)
+def shared_resources():
+    """معاملات العرض والتدرجات اللونية وقوالب الخرائط الثابتة.
+
+    مشتركة بين الجلسات، لذا تُمرَّر نسخ منها لأي كائن قد يعدّلها.
+    """
+    return {
+        "vis_modis": {
+            'min': 0,
+            'max': 0.8,
+            'palette': ['#F5F5DC', "#206B02", "#062E02"],
+            'opacity': 0.9
+        },
+        "vis": {
+            'min': 0,
+            'max': 0.6,
+            'palette': ['#F5F5DC', "#206B02", "#062E02"],
+            'opacity': 0.9
+        },
+        "thumb_vis": {
+            'min': -1,
+            'max': 1,
+            'palette': ['#F5F5DC', "#C5D69D", "#042401"],
+            'dimensions': 1024,
+            'format': 'png',
+            'Opacity': 1.0
+        },
+        "colormap": cm.LinearColormap(["beige", "#aaffaa", "green"], vmin=-1, vmax=1),
+        "esri_tiles": 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        "north_html": f'''
+<div style="
+    position: absolute;
+    top: 20px;
+    right: 20px;
+    z-index: 1000;
+    width: 90px;
+    height: 90px;">
+    <img src="data:image/png;base64,{b64("assets/NORTH.png")}"
+         style="
+            width: 100%;
+            height: 100%;
+            object-fit: contain;
+            transform: rotate(0deg);
+            filter: drop-shadow(2px 2px 4px rgb(255,255,255));" />
+</div>
+''',
+    }
 
-def compute_ndvi_change(cid: str, start: date, end: date):
-    window = 16 if "MOD13A2" in cid else 5
-    nd_s, scale = ndvi_image(cid, start, start + timedelta(days=window), focus_geom)
-    nd_e, _ = ndvi_image(cid, end, end + timedelta(days=window), focus_geom)
-    return nd_e.subtract(nd_s), scale
+@st.cache_resource(show_spinner=False, max_entries=64)
+def outline_geojson(place: str, _fc):
+    """حدود المنطقة بصيغة GeoJSON للرسم، تُجلب مرة واحدة لكل عملية."""
+    return _fc.getInfo()
+
+# ───────── ذاكرة الجلسات ─────────
+SESSION_MEMORY_CAP = 16 * 2**20         # بايت لكل جلسة
+TOTAL_SESSION_MEMORY_CAP = 512 * 2**20  # لكل الجلسات معاً
+SESSION_IDLE_SECONDS = 10 * 60
+MAP_HTML_TTL = 3600
+
+@st.cache_resource(show_spinner=False)
+def _session_registry():
+    """الكائنات الثقيلة لكل جلسة مع أحجامها المقدّرة."""
+    return {"lock": threading.Lock(), "sessions": {}}
+
+def _estimate_bytes(obj):
+    if isinstance(obj, str):
+        return len(obj.encode("utf-8"))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    return sys.getsizeof(obj)
+
+def session_cached(name, build):
+    """كائن ثقيل (مثل HTML الخرائط) محفوظ للجلسة الحالية ومحسوب حجمه.
+
+    عند تجاوز حد الجلسة يُخلى الأقدم استخداماً، وتُخلى كائنات الجلسات الخاملة
+    أو الأقدم نشاطاً عند تجاوز الحد الكلي، فتعيد بناءها فقط إن عادت.
+    """
+    sid = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    registry = _session_registry()
+    now = time.time()
+    with registry["lock"]:
+        sessions = registry["sessions"]
+        for other in [k for k, e in sessions.items() if now - e["last_seen"] > SESSION_IDLE_SECONDS]:
+            del sessions[other]
+        entry = sessions.setdefault(sid, {"objects": OrderedDict(), "bytes": 0})
+        entry["last_seen"] = now
+        if name in entry["objects"]:
+            entry["objects"].move_to_end(name)
+            return entry["objects"][name][0]
+
+    value = build()
+    size = _estimate_bytes(value)
+    with registry["lock"]:
+        objects = entry["objects"]
+        if name in objects:  # بُني في إعادة تشغيل متزامنة
+            entry["bytes"] -= objects.pop(name)[1]
+        objects[name] = (value, size)
+        entry["bytes"] += size
+        while entry["bytes"] > SESSION_MEMORY_CAP and len(objects) > 1:
+            _, (_, old) = objects.popitem(last=False)
+            entry["bytes"] -= old
+
+        total = sum(e["bytes"] for e in sessions.values())
+        for other, e in sorted(sessions.items(), key=lambda kv: kv[1]["last_seen"]):
+            if total <= TOTAL_SESSION_MEMORY_CAP:
+                break
+            if other != sid:
+                total -= e["bytes"]
+                e["objects"].clear()
+                e["bytes"] = 0
+    return value
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def composite_thumb_url(cid: str, place: str, start: date, end: date, vis_params: dict, _geom):
+    """رابط صورة مصغّرة للمركّب (روابط EE مؤقتة، لذا نحدّ عمر الكاش)."""
+    img, _ = period_composite(cid, place, start, end, _geom)
+    return img.getThumbUrl(vis_params)
 
 def get_region_stats(img, scale):
     def compute_stats(feature):
@@ -155,6 +173,122 @@ def get_region_stats(img, scale):
         return feature.set(stats)
     return areas.map(compute_stats).getInfo()["features"]
 
+CHART_POINTS = 400  # أقصى عدد نقاط يُرسل للمتصفح في رسم تطور المؤشر
+
+def zoom_slider(box, df_ts):
+    """🔍 شريط تكبير فترة من السلسلة، فقط عندما تتجاوز ميزانية النقاط."""
+    if len(df_ts) <= CHART_POINTS:
+        return None
+    ts_dates = pd.to_datetime(df_ts['date'])
+    d0, d1 = ts_dates.min().date(), ts_dates.max().date()
+    return box.slider("", min_value=d0, max_value=d1, value=(d0, d1),
+                      format="YYYY-MM-DD", label_visibility="collapsed")
+
+def trend_figure(df_ts, threshold, zoom=None):
+    """رسم تطور المؤشر من نسخة مجمّعة ومقلّلة النقاط من df_ts (دون تعديلها)."""
+    chart_df = df_ts.assign(date=pd.to_datetime(df_ts['date']))
+
+    # فلترة البيانات بناءً على العتبة التي يحددها المستخدم
+    chart_df = chart_df[chart_df['mean_ndvi'] > threshold]
+    if zoom:
+        chart_df = chart_df[chart_df['date'].dt.date.between(*zoom)]
+
+    # تجميع يومي/أسبوعي ثم تقليل النقاط مع الحفاظ على شكل المنحنى (LTTB)
+    chart_df = downsample_series(chart_df, CHART_POINTS)
+
+    # إنشاء الرسم البياني باستخدام Plotly (WebGL لسرعة الرسم في المتصفح)
+    fig = px.line(chart_df, x='date', y='mean_ndvi', render_mode='webgl')
+
+    # تخصيص الشكل (تصميم احترافي)
+    fig.update_layout(
+        xaxis_title="التــاريـخ",
+        yaxis_title="مـؤشـر الـغطاء الـنباتى",
+        font=dict(family="Arial, sans-serif", size=12, color="black"),
+        title_font=dict(size=18, family="Verdana, sans-serif", color='rgb(26, 13, 171)'),  # العنوان الرئيسي
+        xaxis=dict(
+            showgrid=True, 
+            gridcolor='lightgray',
+            title_font=dict(size=16, color="black")  # تخصيص حجم الخط ولونه لمحور x
+        ),
+        yaxis=dict(
+            showgrid=True, 
+            gridcolor='lightgray',
+            title_font=dict(size=16, color="black")  # تخصيص حجم الخط ولونه لمحور y
+        ),
+        title='',  # هنا حذفنا العنوان
+        plot_bgcolor='#F8F9FA',  # إضافة خلفية فاتحة للرسم البياني
+        paper_bgcolor='#F8F9FA',  # إضافة خلفية فاتحة للورقة (المساحة حول الرسم البياني)
+        margin=dict(t=30, b=30, l=30, r=30),  # تعديل الهوامش (اختياري)
+        showlegend=False  # إخفاء الأسطورة إذا كانت غير ضرورية        
+    )
+
+    fig.update_traces(line=dict(color='green', width=3))
+    return fig
+
+def metric_html(title, value, preview=False, value_style=""):
+    """صندوق مقياس؛ القيم التقريبية تُعلَّم بشارة "معاينة" حتى تصل الدقة الكاملة."""
+    badge = " <span style='font-size:12px; color:#b26a00;'>⏳ معاينة</span>" if preview else ""
+    return f"""
+        <div class="metric-box">
+            <div class="metric-title">{title}{badge}</div>
+            <div class="metric-value" style="direction: rtl; {value_style}">
+                {value}
+            </div>
+        </div>
+    """
+
+# ───────── العرض التدريجي ─────────
+PREVIEW_CID = "MODIS/061/MOD13A2"
+PREVIEW_SCALE = 500  # دقة المعاينة السريعة بالمتر
+PREVIEW_WAIT = 0.5   # ثوانٍ ننتظر فيها النتائج الكاملة قبل اللجوء للمعاينة
+REFINE_POLL = 0.25   # ثوانٍ بين كل فحص للنتائج الكاملة
+REFINE_RETRY = 30    # ثوانٍ قبل إعادة حساب فاشل، وتتضاعف مع كل فشل جديد
+REFINE_RETRY_MAX = 600
+REFINE_LABELS = {"metrics": "مؤشرات الخضرة", "df_ts": "تطور المؤشر", "change_stats": "إحصائيات التغير"}
+
+@st.cache_resource(show_spinner=False)
+def _refine_pool():
+    """خيوط مشتركة على مستوى العملية لحسابات الدقة الكاملة في الخلفية."""
+    return ThreadPoolExecutor(max_workers=8)
+
+def refinement_failed(fut):
+    return fut.done() and (fut.cancelled() or fut.exception() is not None)
+
+def start_refinement(key, tasks):
+    """يطلق حسابات الدقة الكاملة، ويلغي ما تبقى من حسابات فلاتر سابقة لنفس الجلسة.
+
+    الحساب الجاري داخل Earth Engine لا يمكن إيقافه، لكن ما لم يبدأ بعد يُلغى.
+    الحسابات الفاشلة لنفس الفلاتر تُعاد وحدها بعد مهلة متضاعفة، لا مع كل تفاعل.
+    """
+    old = st.session_state.get("refinement")
+    if old and old["key"] == key:
+        failed = [name for name, fut in old["futures"].items() if refinement_failed(fut)]
+        if not failed:
+            return old["futures"]
+        old.setdefault("failed_at", time.time())
+        delay = min(REFINE_RETRY * 2 ** old.get("attempt", 0), REFINE_RETRY_MAX)
+        if time.time() - old["failed_at"] < delay:
+            return old["futures"]
+        cancel, attempt = old["cancel"], old.get("attempt", 0) + 1
+        futures = dict(old["futures"])
+    else:
+        if old:
+            old["cancel"].set()
+            for fut in old["futures"].values():
+                fut.cancel()
+        cancel, attempt, futures, failed = threading.Event(), 0, {}, list(tasks)
+
+    def guarded(fn, *args):
+        if cancel.is_set():
+            raise CancelledError()
+        return fn(*args)
+
+    for name in failed:
+        fn, args = tasks[name]
+        futures[name] = _refine_pool().submit(guarded, fn, *args)
+    st.session_state["refinement"] = {"key": key, "cancel": cancel, "futures": futures, "attempt": attempt}
+    return futures
+
 # ───────── واجهة وتصميم ─────────
 custom_css = """
 <style>
@@ -319,8 +453,7 @@ custom_css = """
 st.set_page_config("السعودية الخضراء", layout="wide", page_icon="🌿",)
 logo = _b64("assets/LOGO.png")
 gif_path = r"assets/ndvi_header_banner.gif"
-gif_bytes = open(gif_path, "rb").read()
-gif_data_url = f"data:image/gif;base64,{base64.b64encode(gif_bytes).decode()}"
+gif_data_url = f"data:image/gif;base64,{b64(gif_path)}"
 st.markdown(custom_css + f"""
 <div class="header-box" style="background-image: url('{gif_data_url}');">
     <img class="logo" src="data:image/png;base64,{logo}" alt="Logo"/>
@@ -337,15 +470,8 @@ st.markdown(custom_css + f"""
 """, unsafe_allow_html=True)
 
 
-# ───────── تحميل أشكال المملكة والمناطق والـمدن ─────────
-ksa, areas, cities = (
-    ee.FeatureCollection(KSA_ASSET),
-    ee.FeatureCollection(AREAS_ASSET),
-    ee.FeatureCollection(CITIES_ASSET),
-)
-
 # ───────── عناصر الفلترة ─────────
-regions = [ALL_KSA] + sorted(areas.aggregate_array("PROV_NAME_").distinct().getInfo())
+regions = list_regions()
 c5, c4, c3, c2, c1 = st.columns(5)
 with c1:
     with st.container():
@@ -356,9 +482,7 @@ with c1:
         region = st.selectbox("", regions, index=0, label_visibility="collapsed")
 
 with c2:
-    city_list = ([] if region == ALL_KSA else
-                 cities.filter(ee.Filter.eq("PROV_NAME_", region))
-                       .aggregate_array("Gov_name").distinct().sort().getInfo())
+    city_list = list_cities(region)
     with st.container():
         st.markdown(
             "<div style='text-align:right; direction:rtl; font-size:20px; font-weight:bold; color:#000000; margin-bottom:5px; margin-top:-15px;'>المدينة :</div>",
@@ -399,6 +523,17 @@ with c5:
 
 start, end = max(start, earliest), min(end, latest)
 
+# ───────── NDVI Image ─────────
+# أول حاجة: حدد focus_geom
+focus_fc, focus_geom = focus_area(region, city, cid)
+zoom = 9 if city else 7 if region != ALL_KSA else 5
+place = place_key(region, city)  # مفتاح المنطقة في السجلات والكاش
+
+# st.date_input لا يدعم تعطيل أيام بعينها، لذا نعرض أقرب أيام الالتقاط فوق المنطقة
+# (بصمات المنطقة قد تحتاج طلباً لـ Earth Engine، فتُحسب في الخلفية وتظهر بعد أول عرض)
+snap_note = st.empty()
+snap_future = _refine_pool().submit(snapped_period, cid, start, end, place)
+
 # ✳️ تتبع التغييرات
 current_filters = (region, city, src_name, start, end)
 
@@ -411,140 +546,203 @@ elif st.session_state["last_filters"] != current_filters:
 else:
     st.session_state["reload_trigger"] = False
 
-# ───────── NDVI Image ─────────
-# أول حاجة: حدد focus_geom
-if city:
-    focus_fc = cities.filter(ee.Filter.eq("Gov_name", city))
-    zoom = 9
-elif region != ALL_KSA:
-    focus_fc = areas.filter(ee.Filter.eq("PROV_NAME_", region))
-    zoom = 7
-else:
-    focus_fc = ksa
-    zoom = 5
-
-focus_geom = focus_fc.geometry()
 threshold = st.session_state.get("threshold", 0.1)  # قيمة افتراضية لو مش متحددة لسه
 
-loading_msg = st.empty()  # نحجز مكان لرسالة النجاح بعد التحميل
-
-if st.session_state["reload_trigger"]:
+ndvi_img, src_scale = period_composite(cid, place, start, end, focus_geom)
+
+# حسابات الدقة الكاملة تبدأ في الخلفية فوراً
+refine = start_refinement(current_filters + (threshold,), {
+    "metrics": (area_metrics, (cid, place, start, end, threshold, focus_geom)),
+    "df_ts": (get_time_series, (cid, focus_geom, src_scale, start, end, region, city)),
+    "change_stats": (compute_change_stats, (cid, place, start, end, threshold, focus_geom)),
+})
+wait(refine.values(), timeout=PREVIEW_WAIT)
+failed = {name for name, fut in refine.items() if refinement_failed(fut)}
+preview = {name for name, fut in refine.items() if not fut.done()} | failed
+
+if preview and src_scale < PREVIEW_SCALE:
+    # معاينة سريعة: اختزال المصدر نفسه بدقة 500 م، والسلسلة الزمنية من MODIS
+    _, preview_geom = focus_area(region, city, PREVIEW_CID)
+    preview_tasks = {
+        "metrics": lambda: area_metrics(cid, place, start, end, threshold, preview_geom,
+                                        PREVIEW_SCALE, variant="preview"),
+        "df_ts": lambda: get_time_series(PREVIEW_CID, preview_geom, PREVIEW_SCALE, start, end, region, city),
+        "change_stats": lambda: compute_change_stats(cid, place, start, end, threshold, preview_geom,
+                                                     PREVIEW_SCALE, variant="preview"),
+    }
+    with st.spinner("⚡ جاري تحميل معاينة سريعة .. والدقة الكاملة في الطريق"):
+        results = {name: preview_tasks[name]() if name in preview else fut.result()
+                   for name, fut in refine.items()}
+else:
     with st.spinner("⏳ جاري تحميل الطبقات .. شكراً لانتظارك"):
         # حسابات NDVI وكل البيانات المطلوبة
-        ndvi_img, src_scale = ndvi_image(cid, start, end, focus_geom)
-        high_pct = compute_high_ndvi_ratio(ndvi_img, focus_geom, src_scale, threshold)
-        veg_area = compute_veg_area_km2(ndvi_img, focus_geom, src_scale, threshold)
-        df_ts = get_time_series(cid, focus_geom, src_scale, start, end)
-
-    # ← نخرج من الـ spinner الأول، ثم نعرض رسالة النجاح بوضوح
-    loading_msg.success("🎉 تم تحميل الطبقات بنجاح!")
-    time.sleep(3)  # نسيبها 3 ثواني عشان المستخدم يشوفها
-    loading_msg.empty()
-
-else:
-    # تحميل البيانات من الكاش
-    ndvi_img, src_scale = ndvi_image(cid, start, end, focus_geom)
-    high_pct = compute_high_ndvi_ratio(ndvi_img, focus_geom, src_scale, threshold)
-    veg_area = compute_veg_area_km2(ndvi_img, focus_geom, src_scale, threshold)
-    df_ts = get_time_series(cid, focus_geom, src_scale, start, end)
+        results = {name: fut.result() for name, fut in refine.items()}
+    preview = set()
 
-
-
-# تدرج لوني ديناميكي حسب المصدر
-if "MODIS" in cid:
-    vis = {
-        'min': 0,
-        'max': 0.8,
-        'palette': ['#F5F5DC', "#206B02", "#062E02"],
-        'opacity': 0.9
-    }
-else:
-    vis = {
-        'min': 0,
-        'max': 0.6,
-        'palette': ['#F5F5DC', "#206B02", "#062E02"],
-        'opacity': 0.9
-    }
+metrics, df_ts, change_stats = results["metrics"], results["df_ts"], results["change_stats"]
+if st.session_state["reload_trigger"]:
+    st.toast("🎉 تم تحميل الطبقات بنجاح!")
+refine_warn = st.empty()  # تنبيه عند تعذّر الدقة الكاملة
 
 
 
 # ───────── حساب المقاييس ─────────
-high_pct = compute_high_ndvi_ratio(ndvi_img, focus_geom, src_scale, threshold)
-veg_area = compute_veg_area_km2(ndvi_img, focus_geom, src_scale, threshold)
-df_ts = get_time_series(cid, focus_geom, src_scale, start, end)
+high_pct, veg_area = metrics["high_pct"], metrics["veg_area"]
 
 # ───────── إنشاء الخريطة الأساسية ─────────
-m = geemap.Map(draw_control=False, measure_control=False,
-               toolbar_control=False, fullscreen_control=True)
-m.options.update({"maxBounds": [[15, 34], [32.5, 56.5]], "minZoom": 4.3})
-m.setOptions("HYBRID")
+def build_main_map():
+    """خريطة NDVI الأساسية كـ HTML جاهز للعرض (مثل m.to_streamlit)."""
+    res = shared_resources()
+    # تدرج لوني ديناميكي حسب المصدر
+    vis = dict(res["vis_modis"] if "MODIS" in cid else res["vis"])
+
+    m = geemap.Map(draw_control=False, measure_control=False,
+                   toolbar_control=False, fullscreen_control=True)
+    m.options.update({"maxBounds": [[15, 34], [32.5, 56.5]], "minZoom": 4.3})
+    m.setOptions("HYBRID")
+
+    # 🟢 ضبط نطاق التركيز
+    bounds = focus_geom.bounds().getInfo()['coordinates'][0]
+    m.fit_bounds([[bounds[0][1], bounds[0][0]], [bounds[2][1], bounds[2][0]]])
+
+    # 🟢 أضف طبقة NDVI
+    m.addLayer(ndvi_img, vis, "NDVI", True)
+
+    # ← إضافة مؤشر اتجاه الشمال على الخريطة الأساسية
+    m.get_root().html.add_child(folium.Element(res["north_html"]))
+
+    if zoom != 4.3:
+        m.addLayer(focus_fc.style(color="yellow", width=2, fillColor="00000000"), {}, "")
+        m.addLayer(ksa.style(color="darkgreen", width=1, fillColor="00000000"),{}, "حدود المملكة")
+
+    mini = MiniMap(toggle_display=True, minimized=True, position="bottomleft")
+    mini.add_to(m)
+    folium.Rectangle([[15, 34], [32.5, 56.5]],
+                      fill=False, color="red", weight=2).add_to(mini)
+    copy.copy(res["colormap"]).add_to(m)
+
+    m.add_layer_control()
+    return m.to_html()
+
+def build_dual_map():
+    """خريطة المقارنة (بداية/نهاية الفترة) كـ HTML جاهز للعرض."""
+    # نفس نافذتي البداية والنهاية المستخدمتين في إحصائيات التغير
+    (s0, s1), (e0, e1) = change_windows(cid, start, end, place)
+
+    # احسب الإحداثيات المناسبة من focus_geom
+    bounds = focus_geom.bounds().getInfo()["coordinates"][0]
+    southwest = [bounds[0][1], bounds[0][0]]
+    northeast = [bounds[2][1], bounds[2][0]]
+
+    # أنشئ الخريطة بناءً على المنطقة المحددة
+    dual_map = folium.plugins.DualMap(
+        tiles=None,
+        control_scale=True,
+        draw_control=False, measure_control=False,
+        toolbar_control=False, fullscreen_control=True
+    )
 
-# 🟢 ضبط نطاق التركيز
-bounds = focus_geom.bounds().getInfo()['coordinates'][0]
-m.fit_bounds([[bounds[0][1], bounds[0][0]], [bounds[2][1], bounds[2][0]]])
+    # Add Esri Satellite basemap to both sides
+    folium.TileLayer(
+        tiles=shared_resources()["esri_tiles"],
+        attr='Esri',
+        name='Esri Satellite',
+        overlay=False,
+        control=False,
+        draw_control=False, measure_control=False,
+        toolbar_control=False, fullscreen_control=True           
+    ).add_to(dual_map.m1)
 
-# 🟢 أضف طبقة NDVI
-m.addLayer(ndvi_img, vis, "NDVI", True)
+    folium.TileLayer(
+        tiles=shared_resources()["esri_tiles"],
+        attr='Esri',
+        name='Esri Satellite',
+        overlay=False,
+        control=False,
+        draw_control=False, measure_control=False,
+        toolbar_control=False, fullscreen_control=True            
+    ).add_to(dual_map.m2)
+    dual_map.fit_bounds([southwest, northeast])
+
+
+    # توليد روابط الصور
+    vis_params = shared_resources()["thumb_vis"]
+    url_start = composite_thumb_url(cid, place, s0, s1, vis_params, focus_geom)
+    url_end = composite_thumb_url(cid, place, e0, e1, vis_params, focus_geom)
+
+    # ↓↓↓↓↓ هذا الجزء بالذات لازم يدخل جوة
+    folium.GeoJson(
+        data=copy.deepcopy(outline_geojson(place, focus_fc)),
+        name='الحدود',
+        style_function=lambda x: {
+            'color': '#FFFF0080',  # أصفر شفاف
+            'weight': 2,
+            'fillColor': 'transparent',
+            'fillOpacity': 0
+        }
+    ).add_to(dual_map)
+
+    folium.raster_layers.ImageOverlay(
+        image=url_start,
+        bounds=[southwest, northeast],
+        name='الفترة الأولى',
+        opacity=1.0,
+        draw_control=False, measure_control=False,
+        toolbar_control=False, fullscreen_control=True
+    ).add_to(dual_map.m1)
 
-# ← إضافة مؤشر اتجاه الشمال على الخريطة الأساسية
-north_icon_path = "assets/NORTH.png"
-encoded_arrow = _b64(north_icon_path)
+    folium.raster_layers.ImageOverlay(
+        image=url_end,
+        bounds=[southwest, northeast],
+        name='الفترة الثانية',
+        opacity=1.0,
+        draw_control=False, measure_control=False,
+        toolbar_control=False, fullscreen_control=True
+    ).add_to(dual_map.m2)
 
-north_html = f'''
-<div style="
-    position: absolute;
-    top: 20px;
-    right: 20px;
-    z-index: 1000;
-    width: 90px;
-    height: 90px;">
-    <img src="data:image/png;base64,{encoded_arrow}"
-         style="
-            width: 100%;
-            height: 100%;
-            object-fit: contain;
-            transform: rotate(0deg);
-            filter: drop-shadow(2px 2px 4px rgb(255,255,255));" />
-</div>
-'''
-
-m.get_root().html.add_child(folium.Element(north_html))
-
-if zoom != 4.3:
-    m.addLayer(focus_fc.style(color="yellow", width=2, fillColor="00000000"), {}, "")
-    m.addLayer(KSA_ASSET.style(color="darkgreen", width=1, fillColor="00000000"),{}, "حدود المملكة")
-
-mini = MiniMap(toggle_display=True, minimized=True, position="bottomleft")
-mini.add_to(m)
-folium.Rectangle([[15, 34], [32.5, 56.5]],
-                  fill=False, color="red", weight=2).add_to(mini)
-cm.LinearColormap(["beige", "#aaffaa", "green"], vmin=-1, vmax=1).add_to(m)
-
-# ───────── إنشاء خريطة التغيرات ─────────
-with st.spinner("⏳ جاري حساب التغير في NDVI ..."):
-    change_img, ch_scale = compute_ndvi_change(cid, start, end)
-    vis_ch = {
-    "min": -1,
-    "max": 1,
-    'palette': ['#F5F5DC', "#C5D69D", "#042401"],  # أحمر غامق → أصفر فاتح → أخضر غامق
-    'Opacity': 1.0,
-    "scale": ch_scale
-    }
+    # ✨ نصوص داخل الخريطتين
+    # ✅ بداية الفترة داخل الخريطة الأولى
+    folium.Marker(
+        location=[northeast[0] + 6.0, northeast[0] + 13.0],
+        icon=folium.DivIcon(html=f'''
+        <div style="font-size: 13px; font-weight: bold;
+                background-color: #2e7d32; color: white;
+                padding: 5px 10px; border-radius: 6px;
+                display: inline-block; line-height: 1.2;
+                box-shadow: 1px 1px 6px rgba(0,0,0,0.3);">
+            بداية الفترة - {start.strftime('%Y-%m-%d')}
+        </div>
+    ''')
+).add_to(dual_map.m1)
+
+    # ✅ نهاية الفترة داخل الخريطة الثانية
+    folium.Marker(
+        location=[northeast[0] + 6.0, northeast[0] + 13.0],
+        icon=folium.DivIcon(html=f'''
+        <div style="font-size: 13px; font-weight: bold;
+                background-color: #b71c1c; color: white;
+                padding: 5px 10px; border-radius: 6px;
+                display: inline-block; line-height: 1.2;
+                box-shadow: 1px 1px 6px rgba(0,0,0,0.3);">
+        نهاية الفترة - {end.strftime('%Y-%m-%d')}
+        </div>
+    ''')
+).add_to(dual_map.m2)
 
 
-m_change = geemap.Map(draw_control=False, measure_control=False, toolbar_control=False, fullscreen_control=False)
-m_change.options.update({"maxBounds": [[15, 34], [32.5, 56.5]], "minZoom": 6})
-m_change.setOptions("SATELLITE")
-m_change.fit_bounds([[bounds[0][1], bounds[0][0]], [bounds[2][1], bounds[2][0]]])
-m_change.addLayer(change_img.clip(focus_geom), vis_ch, "ΔNDVI", True)
-m_change.addLayer(focus_fc.style(color="black", width=2, fillColor="00000000"), {}, "حدود المنطقة")
+    # HTML في الذاكرة بدل ملف مؤقت لا يُحذف
+    return dual_map.get_root().render()
+
+# HTML الخرائط محفوظ للجلسة، فلا يُعاد بناؤه عند تغيير العتبة مثلاً
+# (ويتجدد كل ساعة لأن روابط Earth Engine مؤقتة)
+map_key = (cid, place, str(start), str(end), int(time.time() // MAP_HTML_TTL))
 
 # ───────── عرض Streamlit ─────────
 map_col, mid_col, right_col = st.columns([2, 2, 2])  # تم تعديل نسب الأعمدة هنا
 
 with map_col:
     st.markdown('<div class="section-title">🗺 الخريطة الأساسية (NDVI)</div>', unsafe_allow_html=True)
-    m.to_streamlit(height=540)
+    components.html(session_cached(("main_map",) + map_key, build_main_map), height=540)
 
     # ───────── تفسير المؤشر ─────────
     with st.expander('ℹ️ تـفسير مؤشر الغطاء النباتى'):
@@ -564,7 +762,9 @@ with map_col:
 
     # تصدير البيانات بناءً على الفلاتر
     with st.container():
-        if st.button("📥 تصدير البيانات"):
+        # أثناء المعاينة السلسلة من MODIS لا من المصدر المختار، فلا نصدّرها باسمه
+        if st.button("📥 تصدير البيانات", disabled="df_ts" in preview,
+                     help="متاح بعد اكتمال السلسلة بالدقة الكاملة" if "df_ts" in preview else None):
             # تصدير البيانات المفلترة باستخدام الفلاتر التي تم تحديدها
             filtered_df = df_ts[df_ts['date'].between(str(start), str(end))]
             
@@ -578,9 +778,6 @@ with map_col:
             # استخدام العتبة المحددة (threshold) لتصفية البيانات إذا لزم الأمر
             filtered_df = filtered_df[filtered_df['mean_ndvi'] > threshold]
 
-            # قسمة القيم على 10000 لتصحيح الأرقام (إذا كانت كبيرة جدًا)
-            filtered_df['mean_ndvi'] = filtered_df['mean_ndvi'] / 10000  # قسم القيم على 10000
-            
             # تحميل البيانات
             csv = filtered_df.to_csv(index=False).encode('utf-8')
 
@@ -631,71 +828,33 @@ with mid_col:
 
     st.markdown('<div class="section-title">📊 إحصائيات الخضرة</div>', unsafe_allow_html=True)
 
-    st.markdown(f"""
-    <div class="metric-box">
-        <div class="metric-title">نسبة الخضرة</div>
-        <div class="metric-value" style="direction: rtl;">                
-        <div class="metric-value">{high_pct:.1f}%</div>
-    </div>
-    """, unsafe_allow_html=True)
-
+    # صناديق تُستبدل قيمها بالدقة الكاملة عند وصولها
+    pct_box, area_box = st.empty(), st.empty()
+    pct_box.markdown(metric_html("نسبة الخضرة", f"{high_pct:.1f}%", "metrics" in preview),
+                     unsafe_allow_html=True)
     # تنسيق الرقم مع فواصل الآلاف
-    formatted_area = "{:,.2f}".format(veg_area)
-
-    st.markdown(f"""
-        <div class="metric-box">
-            <div class="metric-title">مساحة الخضرة</div>
-            <div class="metric-value" style="direction: rtl;">
-                {formatted_area} كم²
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+    area_box.markdown(metric_html("مساحة الخضرة", f"{veg_area:,.2f} كم²", "metrics" in preview),
+                      unsafe_allow_html=True)
 
 
     st.markdown('<div class="section-title">📈 تطور المؤشر</div>', unsafe_allow_html=True)
-        # تعديل "تطور المؤشر" باستخدام Plotly
-    df_ts['date'] = pd.to_datetime(df_ts['date'])  # تأكد من أن التاريخ هو نوع `datetime`
-
-        # فلترة البيانات بناءً على العتبة التي يحددها المستخدم
-    filtered_df = df_ts[df_ts['mean_ndvi'] > st.session_state['threshold']]
-
-    
-    # تصغير الأرقام عن طريق تقسيمها على 10000 إذا كانت كبيرة
-    filtered_df['mean_ndvi'] = filtered_df['mean_ndvi'] / 10000  # قسم القيم على 10000 لتقليل الأرقام
-
-    # إنشاء الرسم البياني باستخدام Plotly
-    fig = px.line(filtered_df, x='date', y='mean_ndvi')
-
-    # تخصيص الشكل (تصميم احترافي)
-    fig.update_layout(
-        xaxis_title="التــاريـخ",
-        yaxis_title="مـؤشـر الـغطاء الـنباتى",
-        font=dict(family="Arial, sans-serif", size=12, color="black"),
-        title_font=dict(size=18, family="Verdana, sans-serif", color='rgb(26, 13, 171)'),  # العنوان الرئيسي
-        xaxis=dict(
-            showgrid=True, 
-            gridcolor='lightgray',
-            title_font=dict(size=16, color="black")  # تخصيص حجم الخط ولونه لمحور x
-        ),
-        yaxis=dict(
-            showgrid=True, 
-            gridcolor='lightgray',
-            title_font=dict(size=16, color="black")  # تخصيص حجم الخط ولونه لمحور y
-        ),
-        title='',  # هنا حذفنا العنوان
-        plot_bgcolor='#F8F9FA',  # إضافة خلفية فاتحة للرسم البياني
-        paper_bgcolor='#F8F9FA',  # إضافة خلفية فاتحة للورقة (المساحة حول الرسم البياني)
-        margin=dict(t=30, b=30, l=30, r=30),  # تعديل الهوامش (اختياري)
-        showlegend=False  # إخفاء الأسطورة إذا كانت غير ضرورية        
-    )
+    # 🔍 تكبير فترة من السلسلة: تعرض بدقتها الكاملة متى وسعتها ميزانية النقاط
+    # (مع المعاينة يُقرَّر الشريط من السلسلة الكاملة عند وصولها)
+    zoom_box = st.empty()
+    chart_zoom = None if "df_ts" in preview else zoom_slider(zoom_box, df_ts)
 
-    fig.update_traces(line=dict(color='green', width=3))
+    chart_note, chart_box = st.empty(), st.empty()
+    if "df_ts" in preview:
+        chart_note.caption("⏳ معاينة من MODIS (500 م) — تُستبدل بالدقة الكاملة عند اكتمالها")
 
     # عرض الرسم البياني التفاعلي في Streamlit
-    st.plotly_chart(fig, use_container_width=True)
+    chart_box.plotly_chart(trend_figure(df_ts, st.session_state['threshold'], chart_zoom),
+                           use_container_width=True)
 
 
 # ───────── داخل قسم with right_col: ─────────
+CHANGE_TITLES = {"gained": "مساحة مكتسبة", "lost": "مساحة مفقودة", "stable": "مساحة مستقرة"}
+change_boxes = {}
 with right_col:
     st.markdown('<div class="section-title">🕓 خريطة التغيرات (تغير الغطاء النباتي عبر الزمن)</div>', unsafe_allow_html=True)
     
@@ -703,126 +862,17 @@ with right_col:
     if focus_geom is None or focus_geom.area().getInfo() == 0:
         st.warning("⚠️ لا يمكن عرض خريطة التغيرات لأن المدينة المختارة ليس لها بيانات كافية أو غير موجودة.")
     else:
-        with st.spinner("⏳ جاري إعداد خريطة المقارنة..."):
-            ndvi_start, scale_start = ndvi_image(cid, start, start + timedelta(days=16), focus_geom)
-            ndvi_end, scale_end = ndvi_image(cid, end - timedelta(days=16), end, focus_geom)
-    
-            # باقي كود خريطة المقارنة هنا...
-
-
-    
-        # احسب الإحداثيات المناسبة من focus_geom
-        bounds = focus_geom.bounds().getInfo()["coordinates"][0]
-        southwest = [bounds[0][1], bounds[0][0]]
-        northeast = [bounds[2][1], bounds[2][0]]
-
-        # أنشئ الخريطة بناءً على المنطقة المحددة
-        dual_map = folium.plugins.DualMap(
-            tiles=None,
-            control_scale=True,
-            draw_control=False, measure_control=False,
-            toolbar_control=False, fullscreen_control=True
-        )
-
-        # Add Esri Satellite basemap to both sides
-        folium.TileLayer(
-            tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-            attr='Esri',
-            name='Esri Satellite',
-            overlay=False,
-            control=False,
-            draw_control=False, measure_control=False,
-            toolbar_control=False, fullscreen_control=True           
-        ).add_to(dual_map.m1)
-
-        folium.TileLayer(
-            tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-            attr='Esri',
-            name='Esri Satellite',
-            overlay=False,
-            control=False,
-            draw_control=False, measure_control=False,
-            toolbar_control=False, fullscreen_control=True            
-        ).add_to(dual_map.m2)
-        dual_map.fit_bounds([southwest, northeast])
-
-    
-        # توليد روابط الصور
-        vis_params = {
-            'min': -1,
-            'max': 1,
-            'palette': ['#F5F5DC', "#C5D69D", "#042401"],
-            'dimensions': 1024,
-            'format': 'png',
-            'Opacity': 1.0
-        }
-        url_start = ndvi_start.getThumbUrl(vis_params)
-        url_end = ndvi_end.getThumbUrl(vis_params)
-
-        # ↓↓↓↓↓ هذا الجزء بالذات لازم يدخل جوة
-        focus_fc_geojson = focus_fc.getInfo()
-        folium.GeoJson(
-            data=focus_fc_geojson,
-            name='الحدود',
-            style_function=lambda x: {
-                'color': '#FFFF0080',  # أصفر شفاف
-                'weight': 2,
-                'fillColor': 'transparent',
-                'fillOpacity': 0
-            }
-        ).add_to(dual_map)
-    
-        folium.raster_layers.ImageOverlay(
-            image=url_start,
-            bounds=[southwest, northeast],
-            name='الفترة الأولى',
-            opacity=1.0,
-            draw_control=False, measure_control=False,
-            toolbar_control=False, fullscreen_control=True
-        ).add_to(dual_map.m1)
-
-        folium.raster_layers.ImageOverlay(
-            image=url_end,
-            bounds=[southwest, northeast],
-            name='الفترة الثانية',
-            opacity=1.0,
-            draw_control=False, measure_control=False,
-            toolbar_control=False, fullscreen_control=True
-        ).add_to(dual_map.m2)
-
-    # ✨ نصوص داخل الخريطتين
-    # ✅ بداية الفترة داخل الخريطة الأولى
-        folium.Marker(
-            location=[northeast[0] + 6.0, northeast[0] + 13.0],
-            icon=folium.DivIcon(html=f'''
-            <div style="font-size: 13px; font-weight: bold;
-                    background-color: #2e7d32; color: white;
-                    padding: 5px 10px; border-radius: 6px;
-                    display: inline-block; line-height: 1.2;
-                    box-shadow: 1px 1px 6px rgba(0,0,0,0.3);">
-                بداية الفترة - {start.strftime('%Y-%m-%d')}
-            </div>
-        ''')
-    ).add_to(dual_map.m1)
-
-    # ✅ نهاية الفترة داخل الخريطة الثانية
-        folium.Marker(
-            location=[northeast[0] + 6.0, northeast[0] + 13.0],
-            icon=folium.DivIcon(html=f'''
-            <div style="font-size: 13px; font-weight: bold;
-                    background-color: #b71c1c; color: white;
-                    padding: 5px 10px; border-radius: 6px;
-                    display: inline-block; line-height: 1.2;
-                    box-shadow: 1px 1px 6px rgba(0,0,0,0.3);">
-            نهاية الفترة - {end.strftime('%Y-%m-%d')}
-            </div>
-        ''')
-    ).add_to(dual_map.m2)
-
+        # ───────── إحصائيات التغير ─────────
+        for col, key in zip(st.columns(3), CHANGE_TITLES):
+            change_boxes[key] = col.empty()
+            change_boxes[key].markdown(
+                metric_html(CHANGE_TITLES[key], f"{change_stats[key]:,.2f} كم²",
+                            "change_stats" in preview, "font-size: 18px;"),
+                unsafe_allow_html=True)
 
-        with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as f:
-            dual_map.save(f.name)# تقسيم العرض إلى 3 أعمدة: بداية ← الخريطة ← نهاية
-        components.html(open(f.name, 'r', encoding='utf-8').read(), height=360)
+        with st.spinner("⏳ جاري إعداد خريطة المقارنة..."):
+            dual_html = session_cached(("dual_map",) + map_key, build_dual_map)
+        components.html(dual_html, height=360)
 
 
     st.markdown('<div class="section-title">🎥 الخريطة المتحركة</div>', unsafe_allow_html=True)
@@ -871,3 +921,64 @@ st.markdown("""
 
 </div>
 """, unsafe_allow_html=True)
+
+
+# ───────── استبدال المعاينة بالنتائج الكاملة عند اكتمالها ─────────
+# Streamlit لا يوقف التشغيل إلا عند استدعاء st.* التالي، لذا ننتظر على دفعات قصيرة
+# ونلمس عنصراً فارغاً بينها: عند تغيير الفلاتر يتوقف الانتظار فوراً وتُلغى الحسابات المتبقية
+def show_refine_failure(name):
+    """تنبيه واضح بدل شارة «معاينة» لا تختفي: المعروض يبقى تقديرياً حتى إعادة المحاولة."""
+    failed.add(name)
+    if name == "metrics":
+        pct_box.markdown(metric_html("نسبة الخضرة", f"{high_pct:.1f}%"), unsafe_allow_html=True)
+        area_box.markdown(metric_html("مساحة الخضرة", f"{veg_area:,.2f} كم²"), unsafe_allow_html=True)
+    elif name == "df_ts":
+        chart_note.empty()
+    elif name == "change_stats":
+        for key, box in change_boxes.items():
+            box.markdown(metric_html(CHANGE_TITLES[key], f"{change_stats[key]:,.2f} كم²", value_style="font-size: 18px;"),
+                         unsafe_allow_html=True)
+    labels = "، ".join(REFINE_LABELS[n] for n in REFINE_LABELS if n in failed)
+    refine_warn.warning(f"⚠️ تعذّر حساب {labels} بالدقة الكاملة — القيم المعروضة تقديرية من معاينة MODIS (500 م)، "
+                        "وستُعاد المحاولة تلقائياً بعد قليل.")
+
+for name in set(failed):
+    show_refine_failure(name)
+
+def show_snap_note(s_acq, e_acq):
+    # الملاحظة فقط لما وُجد مشهد فعلاً وغيّر الفترة
+    if s_acq and e_acq and (s_acq, e_acq) != (start, end):
+        snap_note.markdown(
+            f"<div style='text-align:right; direction:rtl; color:#555;'>🛰️ أقرب مشاهد متاحة: "
+            f"{s_acq:%Y-%m-%d} ← {e_acq:%Y-%m-%d}</div>",
+            unsafe_allow_html=True
+        )
+
+pending = {refine[name]: name for name in preview - failed}
+pending[snap_future] = "snap"
+refine_tick = st.empty()
+while pending:
+    done, _ = wait(pending, timeout=REFINE_POLL, return_when=FIRST_COMPLETED)
+    refine_tick.empty()
+    for fut in done:
+        name = pending.pop(fut)
+        try:
+            value = fut.result()
+        except Exception:
+            if name != "snap":  # الملاحظة اختيارية، فلا تنبيه لفشلها
+                show_refine_failure(name)
+            continue
+        if name == "snap":
+            show_snap_note(*value)
+        if name == "metrics":
+            pct_box.markdown(metric_html("نسبة الخضرة", f"{value['high_pct']:.1f}%"), unsafe_allow_html=True)
+            area_box.markdown(metric_html("مساحة الخضرة", f"{value['veg_area']:,.2f} كم²"), unsafe_allow_html=True)
+        elif name == "df_ts":
+            chart_note.empty()
+            chart_zoom = zoom_slider(zoom_box, value)
+            chart_box.plotly_chart(trend_figure(value, st.session_state['threshold'], chart_zoom),
+                                   use_container_width=True)
+        elif name == "change_stats":
+            for key, box in change_boxes.items():
+                box.markdown(metric_html(CHANGE_TITLES[key], f"{value[key]:,.2f} كم²", value_style="font-size: 18px;"),
+                             unsafe_allow_html=True)
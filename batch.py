@@ -0,0 +1,218 @@
+"""تشغيل دفعي بدون واجهة لتقارير NDVI الدورية على مستوى المملكة.
+
+يعيد استخدام دوال ndvi_core نفسها التي تستخدمها اللوحة، ويكتب النتائج
+في نفس الكاش المحلي (NDVI_CACHE_DIR) فتفتح اللوحة بعده دون انتظار.
+
+مثال (آخر فترة مكتملة لكل مصدر، لكل المناطق والمدن وكل المصادر):
+
+    python batch.py --out reports/weekly --workers 8 --rate 5
+
+وإعادة تشغيل الأمر نفسه تُكمل من آخر نقطة حفظ دون تكرار المهام المنجزة.
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import pandas as pd
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ndvi_core
+from ndvi_core import SOURCE_IDS, SOURCE_ALIASES, ALL_KSA
+
+CHECKPOINT = "checkpoint.jsonl"
+MIN_PERIOD_WINDOWS = 2  # فترة أقصر من نافذتي إعادة زيارة تجعل نافذتي التغيّر متداخلتين
+
+
+class RateLimiter:
+    """دلو رموز بسيط مشترك بين كل الخيوط: لا يتجاوز `rate` طلباً في الثانية."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def parse_period(text):
+    start, end = text.split(":")
+    return date.fromisoformat(start), date.fromisoformat(end)
+
+
+def min_period_days(cid):
+    return MIN_PERIOD_WINDOWS * ndvi_core.REVISIT_DAYS[cid]
+
+def default_period(cid):
+    """آخر فترة مكتملة للمصدر: نافذتا إعادة زيارة تنتهيان بآخر يوم التقاط في الفهرس.
+
+    (مركّبات MODIS تُنشر بعد 16 يوماً وأكثر، فالأسبوع الماضي يعطي مركّباً فارغاً.)
+    """
+    _, latest = ndvi_core.date_range(cid)
+    end = latest + timedelta(days=1)
+    return end - timedelta(days=min_period_days(cid)), end
+
+def build_jobs(scope, sources, periods):
+    """مصفوفة المهام: (المنطقة/المدينة × المصدر × فترات ذلك المصدر)."""
+    places = []
+    for region in ndvi_core.list_regions():
+        if region == ALL_KSA:
+            if scope in ("kingdom", "all"):
+                places.append((region, ""))
+            continue
+        if scope in ("regions", "all"):
+            places.append((region, ""))
+        if scope in ("cities", "all"):
+            places += [(region, city) for city in ndvi_core.list_cities(region)]
+
+    return [
+        {"region": region, "city": city, "source": cid, "start": str(start), "end": str(end)}
+        for region, city in places
+        for cid in sources
+        for start, end in periods[cid]
+    ]
+
+
+def job_id(job, threshold):
+    """العتبة جزء من المعرّف: تغييرها في نفس مجلد الإخراج يعيد الحساب."""
+    return "|".join((job["source"], job["region"], job["city"], job["start"], job["end"], str(threshold)))
+
+
+def run_job(job, threshold, limiter, retries):
+    """حساب المقاييس والسلسلة الزمنية والتغير لمهمة واحدة مع إعادة المحاولة."""
+    cid, region, city = job["source"], job["region"], job["city"]
+    start, end = date.fromisoformat(job["start"]), date.fromisoformat(job["end"])
+    _, geom = ndvi_core.focus_area(region, city, cid)
+    place = ndvi_core.place_key(region, city)
+    _, scale = ndvi_core.period_composite(cid, place, start, end, geom)
+
+    def call(fn, *args):
+        for attempt in range(retries + 1):
+            limiter.acquire()
+            try:
+                return fn(*args)
+            except Exception:
+                if attempt == retries:
+                    raise
+                time.sleep(min(60, 2 ** attempt))
+
+    metrics = call(ndvi_core.area_metrics, cid, place, start, end, threshold, geom)
+    change = call(ndvi_core.compute_change_stats, cid, place, start, end, threshold, geom)
+    df_ts = call(ndvi_core.get_time_series, cid, geom, scale, start, end, region, city)
+
+    row = {**job, "threshold": threshold, **metrics,
+           **{f"{k}_km2": v for k, v in change.items()}}
+    series = df_ts[["date", "mean_ndvi"]].to_dict("records")
+    return row, series
+
+
+def load_checkpoint(path):
+    """المهام المنجزة سابقاً (سطر JSON لكل مهمة)."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    done[rec["id"]] = rec
+    return done
+
+
+def write_table(df, path_base, fmt):
+    if fmt == "parquet":
+        try:
+            df.to_parquet(path_base + ".parquet", index=False)
+            return path_base + ".parquet"
+        except ImportError:
+            print("⚠️ pyarrow غير مثبت، سيتم الحفظ بصيغة CSV")
+    df.to_csv(path_base + ".csv", index=False, encoding="utf-8-sig")
+    return path_base + ".csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="تقارير NDVI الدفعية للمملكة")
+    parser.add_argument("--key", help="ملف JSON لحساب الخدمة (افتراضياً .streamlit/secrets.toml)")
+    parser.add_argument("--scope", choices=["kingdom", "regions", "cities", "all"], default="all")
+    parser.add_argument("--source", action="append", choices=sorted(SOURCE_ALIASES),
+                        help="يمكن تكراره؛ افتراضياً كل المصادر")
+    parser.add_argument("--period", action="append", type=parse_period,
+                        help="YYYY-MM-DD:YYYY-MM-DD، يمكن تكراره؛ افتراضياً آخر فترة مكتملة لكل مصدر")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=5.0, help="أقصى عدد طلبات EE في الثانية")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="بالدقائق: لا تبدأ مهام جديدة بعدها (تُكمل في التشغيل التالي)")
+    args = parser.parse_args(argv)
+
+    sources = [SOURCE_ALIASES[s] for s in args.source] if args.source else list(SOURCE_IDS.values())
+
+    ndvi_core.init_ee(ndvi_core.load_credentials(args.key))
+    periods = {}
+    for cid in sources:
+        periods[cid] = [p for p in args.period or [default_period(cid)]
+                        if (p[1] - p[0]).days >= min_period_days(cid)]
+        # نرفض الفترات القصيرة بدل كتابة أصفار أو الفشل بعد كل المحاولات
+        for start, end in sorted(set(args.period or []) - set(periods[cid])):
+            print(f"⚠️ {cid}: الفترة {start}:{end} أقصر من {min_period_days(cid)} يوماً، تم تجاهلها")
+    os.makedirs(args.out, exist_ok=True)
+    ckpt_path = os.path.join(args.out, CHECKPOINT)
+    done = load_checkpoint(ckpt_path)
+
+    jobs = [j for j in build_jobs(args.scope, sources, periods) if job_id(j, args.threshold) not in done]
+    print(f"📋 {len(jobs)} مهمة متبقية ({len(done)} منجزة سابقاً)")
+
+    limiter = RateLimiter(args.rate)
+    deadline = time.monotonic() + args.deadline * 60 if args.deadline else None
+    failed = 0
+
+    def guarded(job):
+        if deadline and time.monotonic() > deadline:
+            return None
+        return run_job(job, args.threshold, limiter, args.retries)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, \
+            open(ckpt_path, "a", encoding="utf-8") as ckpt:
+        futures = {pool.submit(guarded, job): job for job in jobs}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {job_id(job, args.threshold)}: {e}")
+                continue
+            if result is None:
+                continue
+            row, series = result
+            rec = {"id": job_id(job, args.threshold), "row": row, "series": series}
+            ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            ckpt.flush()
+            done[rec["id"]] = rec
+
+    # الجداول تخص العتبة الحالية فقط، ونقاط السلسلة تحمل فترة مهمتها لتمييز الفترات المتداخلة
+    recs = {job_id(rec["row"], args.threshold): rec for rec in done.values()
+            if rec["row"]["threshold"] == args.threshold}.values()
+    rows = [rec["row"] for rec in recs]
+    series = [{**{k: rec["row"][k] for k in ("region", "city", "source", "start", "end")}, **pt}
+              for rec in recs for pt in rec["series"]]
+    print("✅", write_table(pd.DataFrame(rows), os.path.join(args.out, "ndvi_metrics"), args.format))
+    print("✅", write_table(pd.DataFrame(series), os.path.join(args.out, "ndvi_timeseries"), args.format))
+
+    remaining = sum(1 for j in jobs if job_id(j, args.threshold) not in done)
+    if remaining:
+        print(f"⏸️ {remaining} مهمة لم تكتمل ({failed} فشلت) — أعد تشغيل الأمر نفسه للإكمال")
+    return 1 if remaining else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
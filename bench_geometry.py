@@ -0,0 +1,105 @@
+"""مقارنة دقة الحدود المبسّطة مقابل الوقت الموفَّر.
+
+    python bench_geometry.py            # محلياً فقط: عدد الرؤوس وخطأ المساحة
+    python bench_geometry.py --ee       # + زمن ونتيجة reduceRegion بالحدود الكاملة والمبسّطة
+
+يتطلب geopandas لبناء الفهرس، و --ee يتطلب بيانات اعتماد Earth Engine.
+"""
+import time
+import argparse
+import statistics
+import pandas as pd
+from datetime import date
+
+import ee
+import ndvi_core
+from ndvi_core import ALL_KSA
+
+
+def offline_report():
+    if not ndvi_core.geometry_index():
+        print("⚠️ geopandas غير مثبت: لا يوجد فهرس محلي، تُبسَّط الحدود على الخادم")
+        return
+    rows = [
+        {"level": level, "name": name, "source": cid, **{k: v for k, v in e.items() if k != "geojson"}}
+        for (level, name, cid), e in ndvi_core.geometry_index().items()
+    ]
+    df = pd.DataFrame(rows)
+    df["vertex_ratio"] = df["vertices"] / df["exact_vertices"]
+    print(df.groupby(["level", "source"]).agg(
+        places=("name", "size"),
+        exact_vertices=("exact_vertices", "sum"),
+        vertices=("vertices", "sum"),
+        mean_ratio=("vertex_ratio", "mean"),
+        max_area_error=("area_error", "max"),
+        exact_kept=("tolerance_m", lambda t: int((t == 0).sum())),
+    ).to_string())
+
+
+def _veg_area(cid, geom, start, end, threshold):
+    img, scale = ndvi_core.ndvi_image(cid, start, end, geom)
+    area = img.gt(threshold).multiply(ee.Image.pixelArea()).rename("area").reduceRegion(
+        ee.Reducer.sum(), geometry=geom, scale=scale,
+        maxPixels=1e13, bestEffort=True, tileScale=4
+    ).get("area", 0)
+    t0 = time.perf_counter()
+    km2 = ee.Number(area).getInfo() / 1e6
+    return km2, time.perf_counter() - t0
+
+
+def _timed_pair(cid, exact, simple, start, end, threshold, repeats):
+    # نبدّل الترتيب في كل تكرار ونأخذ الوسيط، حتى لا تستفيد الثانية دائماً من كاش EE الساخن
+    times = {"exact": [], "simple": []}
+    km2 = {}
+    geoms = {"exact": exact, "simple": simple}
+    for i in range(repeats):
+        order = ("exact", "simple") if i % 2 == 0 else ("simple", "exact")
+        for name in order:
+            km2[name], t = _veg_area(cid, geoms[name], start, end, threshold)
+            times[name].append(t)
+    return km2, {name: statistics.median(ts) for name, ts in times.items()}
+
+
+def ee_report(places, sources, start, end, threshold, repeats):
+    rows = []
+    for region, city in places:
+        for cid in sources:
+            _, exact = ndvi_core.focus_area(region, city)
+            _, simple = ndvi_core.focus_area(region, city, cid)
+            km2, t = _timed_pair(cid, exact, simple, start, end, threshold, repeats)
+            km2_exact, km2_simple, t_exact, t_simple = km2["exact"], km2["simple"], t["exact"], t["simple"]
+            rows.append({
+                "place": ndvi_core.place_key(region, city), "source": cid,
+                "exact_km2": km2_exact, "simple_km2": km2_simple,
+                "rel_error_%": abs(km2_simple - km2_exact) / max(km2_exact, 1e-9) * 100,
+                "exact_s": t_exact, "simple_s": t_simple,
+                "speedup": t_exact / max(t_simple, 1e-9),
+            })
+            print(rows[-1])
+    print(pd.DataFrame(rows).to_string())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أثر تبسيط الحدود")
+    parser.add_argument("--ee", action="store_true", help="تشغيل المقارنة على Earth Engine")
+    parser.add_argument("--key", help="ملف JSON لحساب الخدمة")
+    parser.add_argument("--source", action="append", choices=sorted(ndvi_core.SOURCE_ALIASES))
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2023, 1, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2023, 2, 1))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--repeats", type=int, default=4, help="تكرارات القياس (يُبدَّل الترتيب ويؤخذ الوسيط)")
+    args = parser.parse_args(argv)
+
+    offline_report()
+    if not args.ee:
+        return
+
+    ndvi_core.init_ee(ndvi_core.load_credentials(args.key))
+    sources = ([ndvi_core.SOURCE_ALIASES[s] for s in args.source] if args.source
+               else list(ndvi_core.SOURCE_IDS.values()))
+    places = [(r, "") for r in ndvi_core.list_regions() if r != ALL_KSA]
+    ee_report(places, sources, args.start, args.end, args.threshold, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,634 @@
+import ee
+import os
+import json
+import tomllib
+import hashlib
+import threading
+import functools
+import numpy as np
+import pandas as pd
+from datetime import datetime, date, timedelta
+from google.oauth2 import service_account
+
+try:
+    import geopandas as gpd
+except ImportError:  # اختياري: بدونه تُبسَّط الحدود على خوادم Earth Engine
+    gpd = None
+
+# ───────── الأصول الثابتة ─────────
+EE_PROJECT = "streamlit-ndvi-project-459419"
+KSA_ASSET_ID = f"projects/{EE_PROJECT}/assets/SAUDI"
+AREAS_ASSET_ID = f"projects/{EE_PROJECT}/assets/REGIONS"
+CITIES_ASSET_ID = f"projects/{EE_PROJECT}/assets/CITIES"
+SOURCE_IDS = {
+    "MODIS (500 m / 16 day)": "MODIS/061/MOD13A2",
+    "Sentinel-2 (10 m / 5 day)": "COPERNICUS/S2_SR_HARMONIZED",
+    "Landsat 8-9 (30 m / 16 day)": "LANDSAT/LC08/C02/T1_L2",
+}
+# أسماء مختصرة للمصادر في التشغيل الدفعي والـ API
+SOURCE_ALIASES = {
+    "modis": "MODIS/061/MOD13A2",
+    "s2": "COPERNICUS/S2_SR_HARMONIZED",
+    "landsat": "LANDSAT/LC08/C02/T1_L2",
+}
+ALL_KSA = "المملكة العربية السعودية"
+MIN_YEAR = 2020
+
+# ───────── تهيئة Earth Engine ─────────
+def init_ee(service_account_info):
+    """تهيئة Earth Engine بحساب الخدمة (من st.secrets أو من ملف JSON)."""
+    credentials = service_account.Credentials.from_service_account_info(
+        service_account_info,
+        scopes=["https://www.googleapis.com/auth/earthengine.readonly"]
+    )
+    ee.Initialize(credentials=credentials, project=EE_PROJECT)
+
+def load_credentials(key_path=None):
+    """حساب الخدمة من ملف JSON، أو من أسرار Streamlit نفسها التي تستخدمها اللوحة."""
+    key_path = key_path or os.environ.get("EE_SERVICE_ACCOUNT_FILE")
+    if key_path:
+        with open(key_path, encoding="utf-8") as f:
+            return json.load(f)
+    with open(os.path.join(".streamlit", "secrets.toml"), "rb") as f:
+        return tomllib.load(f)["service-account"]
+
+@functools.lru_cache(maxsize=None)
+def assets():
+    """مقابض الأصول الثابتة، تُنشأ مرة واحدة لكل عملية بعد init_ee."""
+    ksa = ee.FeatureCollection(KSA_ASSET_ID)
+    return {
+        "ksa": ksa,
+        "areas": ee.FeatureCollection(AREAS_ASSET_ID),
+        "cities": ee.FeatureCollection(CITIES_ASSET_ID),
+        "ksa_geom": ksa.geometry(),
+    }
+
+def place_key(region, city=""):
+    """مفتاح المنطقة المستخدم في كل السجلات والكاش."""
+    return f"{region}/{city or ''}"
+
+def focus_area(region, city="", cid=None):
+    """حدود المدينة أو المنطقة أو المملكة ككل.
+
+    عند تمرير المصدر تُعاد الحدود مبسّطة بما يناسب دقته (انظر simplified_geometry)،
+    أما fc فيبقى بالحدود الكاملة للرسم على الخريطة.
+    """
+    a = assets()
+    if city:
+        fc = a["cities"].filter(ee.Filter.eq("Gov_name", city))
+    elif region != ALL_KSA:
+        fc = a["areas"].filter(ee.Filter.eq("PROV_NAME_", region))
+    else:
+        fc = a["ksa"]
+    if cid is None:
+        return fc, fc.geometry()
+    return fc, simplified_geometry(region, city, cid, fc.geometry())
+
+def list_regions():
+    areas = assets()["areas"]
+    return [ALL_KSA] + sorted(areas.aggregate_array("PROV_NAME_").distinct().getInfo())
+
+def list_cities(region):
+    if region == ALL_KSA:
+        return []
+    return (assets()["cities"].filter(ee.Filter.eq("PROV_NAME_", region))
+            .aggregate_array("Gov_name").distinct().sort().getInfo())
+
+# ───────── الكاش المحلي ─────────
+CACHE_DIR = os.environ.get("NDVI_CACHE_DIR", ".cache")
+RECENT_REFETCH_DAYS = 32  # مشاهد آخر شهر قد تُضاف لاحقاً للمصدر، فلا نعتبرها مكتملة
+
+def _cache_path(kind, key):
+    name = hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, kind, f"{name}.pkl")
+
+def _save_pickle(path, obj):
+    """كتابة ذرّية حتى لا يقرأ مستخدم آخر ملفاً نصف مكتوب."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pd.to_pickle(obj, tmp)
+    os.replace(tmp, path)
+
+_results = {}
+_results_lock = threading.Lock()
+
+def cached_result(kind, key, compute, volatile=False):
+    """نتيجة محفوظة على القرص يتشاركها اللوحة والتشغيل الدفعي.
+
+    النتائج "المتقلبة" (فترات تنتهي خلال آخر RECENT_REFETCH_DAYS) تُعاد
+    حسابها بعد CATALOG_TTL_HOURS لأن مشاهد جديدة قد تُضاف لها.
+    """
+    path = _cache_path(kind, key)
+    with _results_lock:
+        entry = _results.get(path)
+    if entry is None and os.path.exists(path):
+        entry = pd.read_pickle(path)
+
+    expired = entry is not None and entry["volatile"] and \
+        datetime.utcnow() - entry["computed_at"] > timedelta(hours=CATALOG_TTL_HOURS)
+    if entry is None or expired:
+        entry = {"value": compute(), "computed_at": datetime.utcnow(), "volatile": volatile}
+        _save_pickle(path, entry)
+
+    with _results_lock:
+        _results[path] = entry
+    return entry
+
+def _is_volatile(end: date):
+    return end > date.today() - timedelta(days=RECENT_REFETCH_DAYS)
+
+# ───────── حدود مبسّطة متعددة الدقة ─────────
+SHP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "Shp")
+# نصف حجم البكسل لكل مصدر: تبسيط أقل من ذلك لا يغيّر البكسلات الداخلة في الحساب
+SIMPLIFY_M = {
+    "MODIS/061/MOD13A2": 250,
+    "COPERNICUS/S2_SR_HARMONIZED": 5,
+    "LANDSAT/LC08/C02/T1_L2": 15,
+}
+MAX_AREA_ERROR = 0.005       # إن غيّر التبسيط المساحة أكثر من 0.5% نُضيّق السماحية
+MAX_INLINE_VERTICES = 20000  # فوق ذلك يصبح إرسال الحدود مع كل طلب أغلى من تبسيطها على الخادم
+UTM_KSA = "EPSG:32638"       # إسقاط متري يغطي المملكة لحساب السماحية بالمتر
+SHP_LAYERS = {
+    "ksa": ("SAUDI", None),
+    "region": ("REGIONS", "PROV_NAME_"),
+    "city": ("CITIES", "Gov_name"),
+}
+GEOMETRY_INDEX_VERSION = 2  # v2: أسماء عربية مقروءة كـ UTF-8 (الملفات بلا .cpg)
+
+_geometry_index = None
+_geometry_lock = threading.Lock()
+_geometry_missing = set()
+
+def _count_vertices(geom):
+    polys = getattr(geom, "geoms", [geom])
+    return sum(len(p.exterior.coords) + sum(len(r.coords) for r in p.interiors) for p in polys)
+
+def build_geometry_index():
+    """نسخ مبسّطة لكل (مستوى، اسم، مصدر) محسوبة مسبقاً من ملفات assets/Shp."""
+    index = {}
+    for level, (name, field) in SHP_LAYERS.items():
+        # لا يوجد ملف .cpg فيُفترض latin-1 وتتشوه الأسماء العربية
+        gdf = gpd.read_file(f"zip://{os.path.join(SHP_DIR, name + '.zip')}", encoding="utf-8")
+        gdf = (gdf.dissolve(by=field) if field else gdf.dissolve()).to_crs(UTM_KSA)
+        for key, exact in gdf.geometry.items():
+            key = key if field else ALL_KSA
+            exact_area = exact.area
+            for cid, tol in SIMPLIFY_M.items():
+                # نضيّق السماحية حتى يصبح خطأ المساحة مقبولاً، وإلا نبقي الحدود الكاملة
+                t = tol
+                while t >= 1:
+                    simple = exact.simplify(t, preserve_topology=True)
+                    err = abs(simple.area - exact_area) / exact_area
+                    if err <= MAX_AREA_ERROR:
+                        break
+                    t /= 2
+                else:
+                    simple, t, err = exact, 0, 0.0
+                wgs = gpd.GeoSeries([simple], crs=UTM_KSA).to_crs(4326).iloc[0]
+                index[(level, key, cid)] = {
+                    "geojson": json.loads(json.dumps(wgs.__geo_interface__)),  # tuples → lists
+                    "tolerance_m": t,
+                    "vertices": _count_vertices(simple),
+                    "exact_vertices": _count_vertices(exact),
+                    "area_error": err,
+                }
+    return index
+
+def geometry_index():
+    """الفهرس محفوظ في الكاش ويُعاد بناؤه فقط عند تغيير السماحيات."""
+    global _geometry_index
+    with _geometry_lock:
+        if _geometry_index is None:
+            key = (GEOMETRY_INDEX_VERSION, sorted(SIMPLIFY_M.items()), MAX_AREA_ERROR)
+            path = _cache_path("geometry", key)
+            if os.path.exists(path):
+                _geometry_index = pd.read_pickle(path)
+            elif gpd is not None:
+                _geometry_index = build_geometry_index()
+                _save_pickle(path, _geometry_index)
+            else:
+                _geometry_index = {}
+    return _geometry_index
+
+def simplified_geometry(region, city, cid, _geom):
+    """حدود مبسّطة بدقة المصدر لـ filterBounds و clip و reduceRegion و area().
+
+    الحدود الصغيرة تُرسل جاهزة من الفهرس المحلي، والكبيرة تُبسَّط على الخادم
+    بنفس السماحية؛ وإذا لم يُقبل أي تبسيط تبقى الحدود الأصلية كما هي.
+    """
+    level, key = ("city", city) if city else ("region", region) if region != ALL_KSA else ("ksa", ALL_KSA)
+    index = geometry_index()
+    entry = index.get((level, key, cid))
+    if index and entry is None and (level, key) not in _geometry_missing:
+        _geometry_missing.add((level, key))
+        print(f"⚠️ لا توجد حدود محلية لـ {level} «{key}»، تُبسَّط على الخادم دون فحص خطأ المساحة")
+    tolerance = entry["tolerance_m"] if entry else SIMPLIFY_M.get(cid, 0)
+    if entry and entry["vertices"] <= MAX_INLINE_VERTICES:
+        return ee.Geometry(entry["geojson"], None, False)
+    if tolerance:
+        return _geom.simplify(maxError=tolerance)
+    return _geom
+
+# ───────── فهرس تواريخ الالتقاط لكل مصدر ─────────
+CLOUD_PROPS = {
+    "COPERNICUS/S2_SR_HARMONIZED": "CLOUDY_PIXEL_PERCENTAGE",
+    "LANDSAT/LC08/C02/T1_L2": "CLOUD_COVER",
+}
+CATALOG_TTL_HOURS = 6
+MAX_SNAP_CLOUD = 60  # لا نلتقط نوافذ التغيّر على أيام غائمة
+# بصمة المشهد: مربع MGRS لـ Sentinel-2 ومسار/صف WRS لـ Landsat
+# (مركّبات MODIS تغطي المملكة كاملة في كل مشهد فلا تحتاج بصمة)
+FOOTPRINT_PROPS = {
+    "COPERNICUS/S2_SR_HARMONIZED": ["MGRS_TILE"],
+    "LANDSAT/LC08/C02/T1_L2": ["WRS_PATH", "WRS_ROW"],
+}
+CATALOG_VERSION = 2  # v2: صف لكل (يوم، بصمة) بدل متوسط يومي على مستوى المملكة
+
+# فهارس مشتركة: المصدر ← أيام الالتقاط فوق المملكة لكل بصمة (عدد المشاهد ومتوسط السحب)
+_catalogs = {}
+_catalog_locks = {}
+_catalog_lock = threading.Lock()
+
+def _footprint(values):
+    """"38RPN" أو "165/43" (أرقام WRS قد تصل كـ float)."""
+    return "/".join(str(int(v)) if isinstance(v, (int, float)) else str(v) for v in values)
+
+def _fetch_catalog(cid: str, start: date, end: date):
+    """أيام الالتقاط في [start، end) مجمّعة لكل (يوم، بصمة)، بطلب واحد لكل سنة."""
+    props = ([CLOUD_PROPS[cid]] if cid in CLOUD_PROPS else []) + FOOTPRINT_PROPS.get(cid, [])
+    cols = ["system:time_start"] + props
+    reducer = ee.Reducer.toList(len(cols)) if props else ee.Reducer.toList()
+    rows = []
+    for year in range(start.year, end.year + 1):
+        a, b = max(start, date(year, 1, 1)), min(end, date(year + 1, 1, 1))
+        if a >= b:
+            continue
+        ic = ee.ImageCollection(cid).filterBounds(assets()["ksa_geom"]).filterDate(str(a), str(b))
+        info = ic.reduceColumns(reducer, cols).getInfo()["list"]
+        rows += [r if props else [r] for r in info]
+
+    df = pd.DataFrame(rows, columns=cols)
+    df["date"] = pd.to_datetime(df["system:time_start"], unit="ms").dt.date
+    fp = FOOTPRINT_PROPS.get(cid, [])
+    df["tile"] = [_footprint(v) for v in df[fp].itertuples(index=False)] if fp else ""
+    df["cloud"] = df[CLOUD_PROPS[cid]] if cid in CLOUD_PROPS else None
+    return (df.groupby(["date", "tile"])
+              .agg(scenes=("date", "size"), cloud=("cloud", "mean"))
+              .reset_index())
+
+def acquisition_catalog(cid: str):
+    """فهرس محفوظ محلياً يُحدَّث تراكمياً (آخر شهر فقط) مرة كل CATALOG_TTL_HOURS."""
+    with _catalog_lock:
+        lock = _catalog_locks.setdefault(cid, threading.Lock())
+
+    # قفل لكل مصدر: تحديث Sentinel-2 الطويل لا يوقف بقية المصادر
+    with lock:
+        path = _cache_path("catalog", (CATALOG_VERSION, cid))
+        entry = _catalogs.get(cid)
+        if entry is None:
+            entry = pd.read_pickle(path) if os.path.exists(path) else None
+
+        now = datetime.utcnow()
+        if entry is None or now - entry["checked_at"] > timedelta(hours=CATALOG_TTL_HOURS):
+            tomorrow = now.date() + timedelta(days=1)
+            if entry is None:
+                since, old = date(MIN_YEAR, 1, 1), None
+            else:
+                since = entry["fetched_until"] - timedelta(days=RECENT_REFETCH_DAYS)
+                old = entry["df"][entry["df"]["date"] < since]
+            fresh = _fetch_catalog(cid, since, tomorrow)
+            df = fresh if old is None else pd.concat([old, fresh], ignore_index=True)
+            entry = {"df": df, "fetched_until": tomorrow, "checked_at": now}
+            _save_pickle(path, entry)
+
+        _catalogs[cid] = entry
+    return entry["df"]
+
+def area_footprints(cid: str, place: str):
+    """بصمات المشاهد التي تغطي المنطقة؛ ثابتة لكل مصدر فتُحفظ دون انتهاء، أو None."""
+    props = FOOTPRINT_PROPS.get(cid)
+    if not props or place == place_key(ALL_KSA):
+        return None
+
+    def compute():
+        _, geom = focus_area(*place.split("/", 1))
+        # سنة كاملة من المشاهد تكفي لتغطية كل المسارات/المربعات فوق المنطقة
+        ic = ee.ImageCollection(cid).filterBounds(geom).filterDate(
+            str(date.today() - timedelta(days=365)), str(date.today()))
+        reducer = ee.Reducer.toList(len(props)) if len(props) > 1 else ee.Reducer.toList()
+        info = ic.reduceColumns(reducer, props).getInfo()["list"]
+        return sorted({_footprint(r if len(props) > 1 else [r]) for r in info})
+
+    return cached_result("footprints", (cid, place), compute)["value"]
+
+def date_range(cid):
+    """أقدم/أحدث تاريخ في المصدر، مع احترام حدّ 2020."""
+    dates = acquisition_catalog(cid)["date"]
+    earliest = max(date(MIN_YEAR,1,1), dates.min())
+    latest = dates.max()
+    return earliest, latest
+
+def snap_to_acquisition(cid: str, day: date, after: bool = True, lo: date = None, hi: date = None,
+                        footprints=None):
+    """أقرب يوم التقاط صالح (قليل السحب) بعد/قبل اليوم المعطى، أو None.
+
+    مع footprints لا تُحتسب إلا المشاهد التي تغطي المنطقة، ومتوسط السحب عليها فقط.
+    """
+    cat = acquisition_catalog(cid)
+    if footprints is not None:
+        cat = cat[cat["tile"].isin(footprints)]
+    cat = cat.groupby("date")["cloud"].mean().reset_index()
+    cat = cat[cat["cloud"].isna() | (cat["cloud"] <= MAX_SNAP_CLOUD)]
+    dates = cat["date"]
+    if lo:
+        dates = dates[dates >= lo]
+    if hi:
+        dates = dates[dates <= hi]
+    dates = dates[dates >= day] if after else dates[dates <= day]
+    if dates.empty:
+        return None
+    return dates.min() if after else dates.max()
+
+# ───────── صور NDVI ─────────
+def ndvi_collection(cid, start, end, _geom=None):
+    """مجموعة صور NDVI لكل مشهد (بقيم -1..1) مع الاحتفاظ بتاريخ الالتقاط."""
+    _geom = _geom or assets()["ksa_geom"]  # استخدم المنطقة المختارة، أو المملكة ككل
+    coll = (ee.ImageCollection(cid)
+            .filterBounds(_geom)
+            .filterDate(str(start), str(end)))
+
+    def keep_props(nd, i):
+        return ee.Image(nd.copyProperties(i, ["system:time_start", "system:index"]))
+
+    # فحص للأخطاء الخاصة بـ Sentinel-2
+    if "COPERNICUS" in cid:  # Sentinel-2
+        coll = coll.map(lambda i: i.updateMask(i.select("QA60").Not()))  # إزالة السحب
+        ndvi_coll = coll.map(lambda i: keep_props(i.normalizedDifference(['B8', 'B4']).rename('NDVI'), i))
+        scale = 10
+        print("تم تحميل بيانات Sentinel-2 بنجاح")
+
+    # فحص للأخطاء الخاصة بـ Landsat
+    elif "LANDSAT" in cid:  # Landsat 8-9
+        # Collection 2: QA_PIXEL (بتات 1 و3 و4 = سحب متمدد/سحب/ظل) ومعاملات تحويل الانعكاس
+        coll = coll.map(lambda i: i.updateMask(i.select("QA_PIXEL").bitwiseAnd(0b11010).eq(0)))  # إزالة السحب
+        sr = lambda i: i.select(['SR_B5', 'SR_B4']).multiply(0.0000275).add(-0.2)
+        ndvi_coll = coll.map(lambda i: keep_props(sr(i).normalizedDifference(['SR_B5', 'SR_B4']).rename('NDVI'), i))
+        scale = 30
+        print("تم تحميل بيانات Landsat بنجاح")
+
+    # فحص لمصادر بيانات أخرى مثل MODIS
+    elif "MODIS" in cid:
+        ndvi_coll = coll.map(lambda i: keep_props(i.select('NDVI').multiply(1/10000), i))
+        scale = 500
+
+    return ndvi_coll, scale
+
+def ndvi_image(cid, start, end, _geom=None):
+    _geom = _geom or assets()["ksa_geom"]
+    ndvi_coll, scale = ndvi_collection(cid, start, end, _geom)
+    return ndvi_coll.mean().clip(_geom), scale
+
+# ───────── المقاييس ─────────
+def _variant_key(place, variant):
+    """مفتاح المركّبات والكاش لنسخة أخرى من الحدود (مثل حدود المعاينة)."""
+    return f"{place}@{variant}" if variant else place
+
+def area_metrics(cid: str, place: str, start: date, end: date, threshold: float, _geom,
+                 scale: int = None, variant: str = None):
+    """نسبة الخضرة (%) ومساحتها (كم²) في طلب واحد، محفوظة في الكاش المشترك.
+
+    scale أكبر من دقة المصدر يعطي معاينة تقريبية سريعة للمساحات الكبيرة، و variant
+    يفصل مركّباتها ونتائجها عن نتائج الحدود الكاملة.
+    """
+    vplace = _variant_key(place, variant)
+
+    def compute():
+        img, src_scale = period_composite(cid, vplace, start, end, _geom)
+        area_img = img.gt(threshold).multiply(ee.Image.pixelArea()).rename("area")
+        veg = area_img.reduceRegion(
+            ee.Reducer.sum(), geometry=_geom, scale=scale or src_scale,
+            maxPixels=1e13, bestEffort=True, tileScale=4
+        ).get("area", 0)
+        stats = ee.Dictionary({"veg": veg, "total": _geom.area()}).getInfo()
+        return {"high_pct": stats["veg"] / stats["total"] * 100, "veg_area": stats["veg"] / 1e6}
+
+    key = (cid, vplace, str(start), str(end), float(threshold)) + ((scale,) if scale else ())
+    return cached_result("metrics", key, compute, _is_volatile(end))["value"]
+
+# ───────── مخزن السلاسل الزمنية التراكمي ─────────
+# مخزن مشترك: (المصدر، المنطقة، المدينة) ← المشاهد المجلوبة والفترات المغطاة
+_series = {}
+_series_locks = {}
+_series_lock = threading.Lock()
+
+def _merge_intervals(intervals):
+    merged = []
+    for a, b in sorted(intervals):
+        if merged and a <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+def _missing_intervals(covered, start, end):
+    """الفترات [من، إلى) غير المغطاة داخل الفترة المطلوبة."""
+    gaps, cur = [], start
+    for a, b in covered:
+        if b <= cur:
+            continue
+        if a >= end:
+            break
+        if a > cur:
+            gaps.append((cur, a))
+        cur = max(cur, b)
+    if cur < end:
+        gaps.append((cur, end))
+    return gaps
+
+# طول دفعة الجلب لكل مصدر: مشاهد Sentinel-2 فوق المملكة تقارب 1000 شهرياً،
+# وEarth Engine يرفض إعادة أكثر من 5000 عنصر في طلب واحد
+SERIES_CHUNK_DAYS = {
+    "MODIS/061/MOD13A2": 366,
+    "COPERNICUS/S2_SR_HARMONIZED": 30,
+    "LANDSAT/LC08/C02/T1_L2": 90,
+}
+
+def _fetch_time_series(cid: str, _geom, scale: int, start: date, end: date):
+    """متوسط NDVI لكل مشهد في [start، end)، بطلب واحد لكل دفعة زمنية."""
+    def feat(img):
+        d = ee.Date(img.get("system:time_start")).format("YYYY-MM-dd")
+        m = img.reduceRegion(
+            ee.Reducer.mean(), geometry=_geom, scale=scale,
+            maxPixels=1e13, bestEffort=True, tileScale=4
+        ).get("NDVI")
+        return ee.Feature(None, {"id": img.get("system:index"), "date": d, "mean": m})
+
+    step = timedelta(days=SERIES_CHUNK_DAYS.get(cid, 366))
+    feats, a = [], start
+    while a < end:
+        b = min(a + step, end)
+        ndvi_coll, _ = ndvi_collection(cid, a, b, _geom)
+        feats += ndvi_coll.map(feat).getInfo()["features"]
+        a = b
+
+    return pd.DataFrame({
+        "id": [f["properties"]["id"] for f in feats],
+        "date": [f["properties"]["date"] for f in feats],
+        "mean_ndvi": [f["properties"].get("mean") for f in feats]
+    }, columns=["id", "date", "mean_ndvi"])
+
+def get_time_series(cid: str, _geom, scale: int, start: date, end: date, region=None, city=None):
+    """سلسلة NDVI للفترة [start، end) مع جلب الفترات الناقصة فقط من Earth Engine."""
+    key = (cid, region, city or "", scale)
+    with _series_lock:
+        lock = _series_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        entry = _series.get(key)
+        if entry is None:
+            path = _cache_path("timeseries", key)
+            entry = (pd.read_pickle(path) if os.path.exists(path) else
+                     {"covered": [], "df": pd.DataFrame(columns=["id", "date", "mean_ndvi"])})
+            _series[key] = entry
+
+        # الأيام الأخيرة تُعتبر مغطاة مؤقتاً فقط، وتُراجع مرة كل CATALOG_TTL_HOURS
+        now = datetime.utcnow()
+        checked_at = entry.get("checked_at")
+        fresh_recent = checked_at is not None and now - checked_at <= timedelta(hours=CATALOG_TTL_HOURS)
+        recent = entry.get("recent", []) if fresh_recent else []
+
+        gaps = _missing_intervals(_merge_intervals(entry["covered"] + recent), start, end)
+        if gaps:
+            fresh = [_fetch_time_series(cid, _geom, scale, a, b) for a, b in gaps]
+            df_all = pd.concat([entry["df"], *fresh], ignore_index=True)
+            df_all = df_all.drop_duplicates("id", keep="last").sort_values("date", ignore_index=True)
+            settled = date.today() - timedelta(days=RECENT_REFETCH_DAYS)
+            done = [(a, min(b, settled)) for a, b in gaps if min(b, settled) > a]
+            tail = [(max(a, settled), b) for a, b in gaps if b > settled]
+            entry = {
+                "covered": _merge_intervals(entry["covered"] + done),
+                "recent": _merge_intervals(recent + tail),
+                "checked_at": checked_at if recent else now,
+                "df": df_all,
+            }
+            _series[key] = entry
+
+            _save_pickle(_cache_path("timeseries", key), entry)
+
+    df = entry["df"]
+    df = df[df["date"].between(str(start), str(end), inclusive="left")]
+    df = df.dropna(subset=["mean_ndvi"])[["date", "mean_ndvi"]].reset_index(drop=True)
+    df["mean_ndvi"] = df["mean_ndvi"].astype(float)
+
+    # إضافة الأعمدة الخاصة بالمدينة والمنطقة إذا تم تحديدهما
+    if region:
+        df["region"] = region
+    if city:
+        df["city"] = city
+
+    return df
+
+# ───────── تجهيز السلسلة للرسم ─────────
+WEEKLY_AFTER_DAYS = 4  # إن زادت الأيام عن 4 أضعاف ميزانية النقاط نجمّع أسبوعياً أولاً
+
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets: مؤشرات n نقطة تحافظ على شكل المنحنى."""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    every = (size - 2) / (n - 2)
+    idx, a = [0], 0
+    for i in range(n - 2):
+        # متوسط الحاوية التالية
+        n0 = int((i + 1) * every) + 1
+        n1 = min(int((i + 2) * every) + 1, size)
+        avg_x, avg_y = x[n0:n1].mean(), y[n0:n1].mean()
+        # النقطة في الحاوية الحالية التي تصنع أكبر مثلث
+        b0, b1 = int(i * every) + 1, n0
+        area = np.abs((x[a] - avg_x) * (y[b0:b1] - y[a]) - (x[a] - x[b0:b1]) * (avg_y - y[a]))
+        a = b0 + int(area.argmax())
+        idx.append(a)
+    idx.append(size - 1)
+    return np.array(idx)
+
+def downsample_series(df, max_points):
+    """تجميع المشاهد المتكررة في نفس اليوم (أو الأسبوع للفترات الطويلة) ثم LTTB.
+
+    df يحتوي عمودي date (datetime) و mean_ndvi؛ تُعاد نسخة جديدة دون تعديل الأصل.
+    """
+    daily = df.groupby(df["date"].dt.floor("D"))["mean_ndvi"].mean()
+    if len(daily) > max_points * WEEKLY_AFTER_DAYS:
+        daily = daily.resample("W").mean().dropna()
+    daily = daily.reset_index()
+    keep = lttb(daily["date"].astype("int64").to_numpy(dtype=float),
+                daily["mean_ndvi"].to_numpy(dtype=float), max_points)
+    return daily.iloc[keep].reset_index(drop=True)
+
+# ───────── سجل المركّبات الزمنية المشتركة ─────────
+# طول نافذة المركّب لكل مصدر (دورة إعادة الزيارة)
+REVISIT_DAYS = {
+    "MODIS/061/MOD13A2": 16,
+    "COPERNICUS/S2_SR_HARMONIZED": 5,
+    "LANDSAT/LC08/C02/T1_L2": 16,
+}
+MAX_COMPOSITES = 256
+
+# سجل مشترك على مستوى العملية: (المصدر، المنطقة، النافذة) ← (الصورة، الدقة)
+_composites = {}
+_composites_lock = threading.Lock()
+
+def period_composite(cid: str, place: str, start: date, end: date, _geom):
+    """مركّب NDVI لفترة معيّنة، يُبنى مرة واحدة ويُعاد استخدامه."""
+    key = (cid, place, str(start), str(end))
+    with _composites_lock:
+        if key not in _composites:
+            if len(_composites) >= MAX_COMPOSITES:
+                _composites.pop(next(iter(_composites)))  # إزالة الأقدم
+            _composites[key] = ndvi_image(cid, start, end, _geom)
+        return _composites[key]
+
+def snapped_period(cid: str, start: date, end: date, place: str = None):
+    """أول وآخر يوم التقاط صالح داخل الفترة فوق المنطقة (عند تمرير place)؛ None لما لا يوجد."""
+    footprints = area_footprints(cid, place) if place is not None else None
+    s_acq = snap_to_acquisition(cid, start, after=True, hi=end, footprints=footprints)
+    e_acq = snap_to_acquisition(cid, end, after=False, lo=start, footprints=footprints)
+    return s_acq, e_acq
+
+def change_windows(cid: str, start: date, end: date, place: str = None):
+    """نافذتا بداية ونهاية الفترة المستخدمتان في كل حسابات التغيّر.
+
+    تُلتقط النافذتان على أقرب أيام فيها مشهد قليل السحب فوق المنطقة نفسها
+    (عند تمرير place) حتى لا ينتج مركّب فارغ.
+    """
+    window = timedelta(days=REVISIT_DAYS.get(cid, 16))
+    s_acq, e_acq = snapped_period(cid, start, end, place)
+    s0 = s_acq or start
+    e1 = e_acq + timedelta(days=1) if e_acq else end
+    return (s0, s0 + window), (e1 - window, e1)
+
+def compute_change_stats(cid: str, place: str, start: date, end: date, threshold: float, _geom,
+                         scale: int = None, variant: str = None):
+    """مساحات الخضرة المكتسبة/المفقودة/المستقرة (كم²) فوق العتبة في طلب واحد.
+
+    النوافذ تُلتقط دائماً على بصمات المنطقة الحقيقية، و variant يخص المركّبات والكاش فقط.
+    """
+    vplace = _variant_key(place, variant)
+
+    def compute():
+        (s0, s1), (e0, e1) = change_windows(cid, start, end, place)
+        nd_s, src_scale = period_composite(cid, vplace, s0, s1, _geom)
+        nd_e, _ = period_composite(cid, vplace, e0, e1, _geom)
+        before, after = nd_s.gt(threshold), nd_e.gt(threshold)
+        classes = ee.Image.cat([
+            after.And(before.Not()).rename("gained"),
+            before.And(after.Not()).rename("lost"),
+            before.And(after).rename("stable"),
+        ]).multiply(ee.Image.pixelArea())
+        stats = classes.reduceRegion(
+            ee.Reducer.sum(), geometry=_geom, scale=scale or src_scale,
+            maxPixels=1e13, bestEffort=True, tileScale=4
+        ).getInfo()
+        return {k: (stats.get(k) or 0) / 1e6 for k in ("gained", "lost", "stable")}
+
+    key = (cid, vplace, str(start), str(end), float(threshold)) + ((scale,) if scale else ())
+    return cached_result("change", key, compute, _is_volatile(end))["value"]